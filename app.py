@@ -3,10 +3,23 @@
 # Supports: Text to Video, Image to Video, Text to Image, Image to Image.
 
 import streamlit as st
-import fal_client
 import time
+import random
+import itertools
 import requests
 import os
+import uuid
+
+from blobs import BlobStore
+from clients import CLIENTS, ClientPool
+from downloads import download_to
+from jobs import Job, JobScheduler, QueueFullError
+from journal import JobJournal
+from media import PIL_AVAILABLE, make_thumbnail
+from models import MODELS, RESOLUTIONS, build_api_args, chain_template, input_size
+from server import start_in_background
+from services import DOWNLOAD_DIR, DOWNLOAD_TTL, create_blob_store, create_journal, create_scheduler
+from uploads import UploadPrefetcher, upload_many
 
 # ---------------------------
 # Page and State Configuration
@@ -18,60 +31,227 @@ st.set_page_config(
 )
 
 # ---------------------------
-# API Key & Model Definitions
+# API Key & Runtime Settings
 # ---------------------------
 # IMPORTANT: Replace this placeholder with your actual fal.ai API key.
 # For security, use Streamlit secrets: [server] secret = "YOUR_FAL_KEY"
 DEFAULT_FAL_KEY = os.environ.get("FAL_KEY", "FAL_KEY_HERE")
 
-MODELS = {
-    "Text to Video": {
-        "id": "fal-ai/wan-25-preview/text-to-video",
-        "type": "text-to-video",
-        "output": "video"
-    },
-    "Image to Video": {
-        "id": "fal-ai/seed-1-image-to-video",
-        "type": "image-to-video",
-        "output": "video"
-    },
-    "Text to Image": {
-        "id": "fal-ai/stable-diffusion-xl-lightning",
-        "type": "text-to-image",
-        "output": "image"
-    },
-    "Image to Image": {
-        "id": "fal-ai/sdxl-img2img",
-        "type": "image-to-image",
-        "output": "image"
-    },
-}
+# With FAL_USE_WORKER=1 jobs are handed to `python worker.py` through the job
+# journal instead of running inside the Streamlit server.
+USE_WORKER = os.environ.get("FAL_USE_WORKER") == "1"
+
+# With FAL_HTTP_PORT set, the JSON API from server.py is served from this
+# process too, so API and UI jobs share the same scheduler and caches.
+HTTP_PORT = os.environ.get("FAL_HTTP_PORT")
 
 # Initialize session state
 if 'results' not in st.session_state:
     st.session_state.results = []
 if 'uploaded_file_data' not in st.session_state:
     st.session_state.uploaded_file_data = None
+if 'pending_jobs' not in st.session_state:
+    st.session_state.pending_jobs = []
+if 'session_id' not in st.session_state:
+    # Kept in the URL so a reloaded tab finds its jobs again
+    st.session_state.session_id = st.query_params.get("session") or uuid.uuid4().hex
+    st.query_params["session"] = st.session_state.session_id
+if 'restored' not in st.session_state:
+    st.session_state.restored = False
+if 'sweeps' not in st.session_state:
+    st.session_state.sweeps = {}
+if 'batch_uploads' not in st.session_state:
+    st.session_state.batch_uploads = {}  # Upload identity -> stored image, for the multi-image uploader
+if 'upload_prefetcher' not in st.session_state:
+    st.session_state.upload_prefetcher = UploadPrefetcher()
 
 # ---------------------------
 # Helper Functions
 # ---------------------------
-@st.cache_data(show_spinner="Downloading result...")
-def download_file(url: str) -> bytes:
-    """Downloads a file from a URL and returns its content."""
+@st.cache_data(show_spinner="Downloading result...", ttl=300)
+def download_file(url: str) -> str | None:
+    """Streams a result file to disk (resuming interrupted downloads) and returns its path."""
     try:
-        response = requests.get(url, timeout=60)
-        response.raise_for_status()
-        return response.content
-    except requests.RequestException as e:
+        # One resume, then report it and move on; stale downloads are pruned as new ones arrive
+        return download_to(DOWNLOAD_DIR, url, attempts=2, max_age=DOWNLOAD_TTL)
+    except (OSError, requests.RequestException) as e:
         st.error(f"Failed to download file: {e}")
-        return b""
+        return None
+
+def read_file(path: str) -> bytes:
+    """Download-button data; read only when the button is clicked, since Streamlit serves it from memory."""
+    with open(path, "rb") as f:
+        return f.read()
+
+def upload_identity(uploaded_file) -> str:
+    """Stays the same across reruns for as long as the same file sits in the uploader."""
+    return getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+
+def store_upload(uploaded_file) -> dict:
+    """Copies a newly dropped file into the blob store and returns what the session keeps of it."""
+    return {
+        "id": upload_identity(uploaded_file),
+        "name": uploaded_file.name,
+        "type": uploaded_file.type,
+        "size": uploaded_file.size,
+        "digest": get_blob_store().put(uploaded_file.getbuffer())
+    }
+
+def read_upload(digest: str, sources: dict):
+    """A stored upload's bytes; if its blob was collected meanwhile, the file still in the uploader is stored again."""
+    try:
+        return get_blob_store().read(digest)
+    except FileNotFoundError:
+        if digest not in sources:
+            raise
+        get_blob_store().put(sources[digest].getbuffer())
+        return get_blob_store().read(digest)
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def preview_image(digest: str) -> bytes | str:
+    """A small thumbnail of a stored image for previews (its full-size file without Pillow)."""
+    if PIL_AVAILABLE:
+        try:
+            return make_thumbnail(get_blob_store().read(digest))
+        except OSError:
+            pass  # Not decodable here; let the browser try the original
+    return get_blob_store().path(digest)
+
+def parse_values(text: str, cast=float) -> list:
+    """Parses a comma-separated list of sweep values, e.g. "0.3, 0.5, 0.7"."""
+    return [cast(value.strip()) for value in text.split(",") if value.strip()]
+
+@st.cache_resource
+def get_journal() -> JobJournal:
+    """Returns the job journal shared by every session in this process."""
+    return create_journal()
+
+@st.cache_resource
+def get_scheduler() -> JobScheduler:
+    """Returns the job scheduler shared by every session in this process."""
+    return create_scheduler(get_journal())
+
+@st.cache_resource
+def get_blob_store() -> BlobStore:
+    """Returns the on-disk store uploaded images are kept in; sessions only hold their digests."""
+    return create_blob_store()
+
+@st.cache_resource
+def get_client_pool() -> ClientPool:
+    """Returns the fal client pool every upload and inference call in this process draws from."""
+    return CLIENTS
+
+@st.cache_resource
+def start_http_api(port: int):
+    """Starts the HTTP API once per process, next to the UI."""
+    return start_in_background(port, get_journal(), None if USE_WORKER else get_scheduler(),
+                               host=os.environ.get("FAL_HTTP_HOST", "127.0.0.1"))
+
+def submit_job(job: Job, max_in_flight: int | None = None):
+    """Runs a job in this process or hands it to the worker; raises QueueFullError when its lane is full."""
+    if USE_WORKER:
+        get_journal().enqueue(job)
+    else:
+        get_scheduler().submit(job, max_in_flight=max_in_flight)
+
+def find_job(job_id: str) -> Job | None:
+    """The live job if this process runs it, else its journaled state."""
+    return (None if USE_WORKER else get_scheduler().get(job_id)) or get_journal().get(job_id)
+
+def result_entry(job: Job) -> dict:
+    """Turns a completed job into an entry for st.session_state.results."""
+    return {
+        "job_id": job.id,
+        "url": job.output['url'],
+        "type": job.output_type,
+        "seed": job.seed,
+        "prompt": job.prompt,
+        "group": job.group,
+        "label": job.label,
+        "path": job.output.get("local_path"),
+        "cached": job.cached
+    }
+
+def restore_session(session_id: str):
+    """Pulls a session's journaled results and still-running jobs back into session state."""
+    known = {res.get("job_id") for res in st.session_state.results} | {job.id for job in st.session_state.pending_jobs}
+    for job in get_journal().for_session(session_id):
+        if job.id in known:
+            continue
+        if job.status == "Completed":
+            st.session_state.results.insert(0, result_entry(job))
+        elif not job.done:
+            # The live job if this process runs it; otherwise the journal copy, refreshed while another
+            # process (a worker, or the previous run until its lease lapses) finishes it
+            st.session_state.pending_jobs.append(find_job(job.id) or job)
+
+@st.fragment(run_every=2)
+def render_pending_jobs():
+    """Shows in-flight jobs and streams finished ones into the results as they complete."""
+    jobs = st.session_state.pending_jobs
+    jobs[:] = [find_job(job.id) or job for job in jobs]  # Picks up jobs run elsewhere or taken over by this process
+    scheduler = None if USE_WORKER else get_scheduler()
+    finished = False
+    if len(jobs) > 1:
+        done = sum(job.done for job in jobs)
+        st.progress(done / len(jobs), text=f"{done} of {len(jobs)} jobs finished")
+    for lane in sorted({scheduler.lane_for(job).name for job in jobs}) if scheduler else []:
+        queue_depth = scheduler.depth(lane)
+        if queue_depth:
+            st.caption(f"{queue_depth} {lane} job(s) waiting for a slot across all users.")
+
+    for job in list(jobs):
+        elapsed = int((job.finished_at or time.time()) - job.submitted_at)
+        if job.status == "Completed" and job.chain and not job.child_id:
+            st.info(f"🎬 `{job.model_id}` finished · starting the animation\n\nPrompt: {job.prompt}")
+        elif job.status == "Completed":
+            st.session_state.results.insert(0, result_entry(job))
+            jobs.remove(job)
+            child = find_job(job.child_id) if job.child_id else None
+            if child is not None:
+                jobs.append(child)  # The chained image-to-video job picks up from here
+            finished = True
+        elif job.status == "Failed":
+            st.error(f"Generation with `{job.model_id}` failed: {job.error}")
+            if job.raw_result:
+                st.json(job.raw_result)
+            if st.button("Dismiss", key=f"dismiss_{job.id}"):
+                jobs.remove(job)
+                finished = True
+        else:
+            status = job.status
+            if job.leader is not None:
+                status = f"{job.leader.status} · shared with an identical request"
+            elif status == "Enqueued":
+                status = "Waiting for a worker"
+            elif status == "Pending" and scheduler is None:
+                status = "Waiting for a slot"
+            elif status == "Pending":
+                position = scheduler.position(job)
+                status = f"Waiting for a slot (position {position} of {scheduler.depth(scheduler.lane_for(job).name)})" if position else "Starting"
+            elif status == "Queued" and job.position:
+                status = f"Queued at fal.ai (position {job.position})"
+            elif status == "Retrying":
+                status = f"Retrying {job.note}"
+            if job.hedged:
+                status += " · hedged"
+            st.info(f"⏳ `{job.model_id}` — {status} · {elapsed}s elapsed\n\nPrompt: {job.prompt}")
+            logs = (job.leader or job).logs
+            if logs:
+                st.code("\n".join(logs[-8:]), language=None)
+
+    if finished:
+        st.rerun()
+
+# ---------------------------
+# Session Restore
+# ---------------------------
+if not st.session_state.restored:
+    restore_session(st.session_state.session_id)
+    st.session_state.restored = True
 
-def upload_image_to_fal(file_data: bytes, content_type: str, api_key: str):
-    """Uploads image data to fal.ai's storage and returns the URL."""
-    client = fal_client.SyncClient(key=api_key)
-    file_url = client.upload(file_data, content_type=content_type)
-    return file_url
+if HTTP_PORT:
+    start_http_api(int(HTTP_PORT))
 
 # ---------------------------
 # UI Layout Structure
@@ -95,24 +275,65 @@ with left_col:
     model_type = model_config["type"]
     output_type = model_config["output"]
 
+    # --- Run Mode ---
+    run_mode = st.radio("**Run Mode**", ["Single", "Batch", "Sweep"], horizontal=True,
+                        help="Batch runs every prompt (one per line) with several seeds each, "
+                             "on every uploaded image. "
+                             "Sweep runs one prompt over every combination of the chosen settings.")
+
     # --- Image Input (Conditional) ---
     image_input_needed = model_type in ["image-to-video", "image-to-image"]
     image_url_from_input = None
 
-    if image_input_needed:
+    batch_images = []  # Start images of a multi-image batch; each one fans out into its own jobs
+    upload_sources = {}  # Digest -> the file in the uploader it came from, for read_upload
+
+    if image_input_needed and run_mode == "Batch":
+        st.subheader("Upload Images")
+        uploaded_files = st.file_uploader(
+            "Drag and drop your starting images here",
+            type=["png", "jpg", "jpeg", "webp"],
+            accept_multiple_files=True,
+            key="start_frames_uploader"
+        )
+        known = st.session_state.batch_uploads
+        for uploaded_file in uploaded_files or []:
+            identity = upload_identity(uploaded_file)
+            image = known.get(identity)
+            if image is None or not get_blob_store().has(image["digest"]):  # New, or collected from the blob store
+                image = store_upload(uploaded_file)  # Only these files are read and hashed
+            known[identity] = image
+            upload_sources[image["digest"]] = uploaded_file
+            if image["digest"] not in {other["digest"] for other in batch_images}:  # The same picture selected twice
+                batch_images.append(image)
+        for identity in set(known) - {upload_identity(uploaded_file) for uploaded_file in uploaded_files or []}:
+            del known[identity]
+        st.session_state.uploaded_file_data = None
+        with st.expander("Or use a public URL"):
+            image_url_from_input = st.text_input("Image URL", placeholder="https://...")
+            if image_url_from_input:
+                batch_images = []  # Prioritize URL if provided
+        if batch_images:
+            st.caption(f"{len(batch_images)} image(s) selected; each one runs every prompt and seed.")
+            st.image([preview_image(image["digest"]) for image in batch_images[:12]], width=96)
+        st.divider()
+    elif image_input_needed:
         st.subheader("Upload an Image")
         uploaded_file = st.file_uploader(
             "Drag and drop your starting image here",
             type=["png", "jpg", "jpeg", "webp"],
             key="start_frame_uploader"
         )
-        if uploaded_file:
-            st.session_state.uploaded_file_data = {
-                "name": uploaded_file.name,
-                "type": uploaded_file.type,
-                "data": uploaded_file.getvalue()
-            }
-        
+        current = st.session_state.uploaded_file_data
+        stored = current is not None and get_blob_store().has(current["digest"])
+        if uploaded_file and not (stored and current.get("id") == upload_identity(uploaded_file)):
+            # New file, or its blob was collected after sitting unused; reruns with the same stored file skip this
+            st.session_state.uploaded_file_data = store_upload(uploaded_file)
+        elif current and not stored:
+            st.session_state.uploaded_file_data = None  # Collected, and no longer in the uploader either
+        if uploaded_file and st.session_state.uploaded_file_data:
+            upload_sources[st.session_state.uploaded_file_data["digest"]] = uploaded_file
+
         with st.expander("Or use a public URL"):
             image_url_from_input = st.text_input("Image URL", placeholder="https://...")
             if image_url_from_input:
@@ -121,29 +342,43 @@ with left_col:
     else:
         st.session_state.uploaded_file_data = None
 
+    animate = False
+    if model_type == "text-to-image":
+        animate = st.checkbox("🎬 Animate each image", help="Pipe every finished image straight into "
+                                                          f"`{MODELS['Image to Video']['id']}` with the same prompt.")
+
     # --- Common Inputs ---
-    st.subheader("Enter a Prompt")
+    if run_mode == "Batch":
+        st.subheader("Enter Prompts (one per line)")
+    else:
+        st.subheader("Enter a Prompt")
     prompt = st.text_area(
         "Prompt",
         "A cinematic shot of a futuristic city at sunset, neon lights reflecting on wet streets.",
-        height=100,
+        height=150 if run_mode == "Batch" else 100,
         label_visibility="collapsed"
     )
+    prompts = [line.strip() for line in prompt.splitlines() if line.strip()] if run_mode == "Batch" else [prompt]
 
     st.subheader("Adjust Settings")
     settings_col1, settings_col2 = st.columns(2)
     with settings_col1:
         if "video" in model_type:
             duration = st.select_slider("Video Length (s)", options=[*range(3, 11)], value=5)
-        resolution = st.selectbox("Resolution / Aspect Ratio",
-                                  ["1024x1024", "1280x720 (16:9)", "720x1280 (9:16)", "1024x576"],
-                                  index=0)
+        resolution = st.selectbox("Resolution / Aspect Ratio", RESOLUTIONS, index=0)
     with settings_col2:
         seed = st.number_input("Seed (-1 for random)", value=-1, step=1)
+        if run_mode == "Batch":
+            seeds_per_prompt = st.number_input("Seeds per Prompt", min_value=1, max_value=16, value=4, step=1,
+                                               help="A fixed seed is incremented per run; -1 picks random seeds.")
+        max_concurrent_jobs = st.slider("Max Concurrent Jobs", 1, 8, 4,
+                                        help="How many of your generations run against fal.ai at the same time. "
+                                             "Server-wide and per-key limits also apply.")
 
     # --- Advanced Settings ---
     audio_url = None  # Initialize audio_url outside the expander
     strength = 0.75   # Default strength value
+    duration = duration if "video" in model_type else 5
     
     with st.expander("Advanced Settings"):
         if model_type == "image-to-image":
@@ -151,123 +386,225 @@ with left_col:
         if "video" in model_type:
             audio_url = st.text_input("Audio URL (optional)", placeholder="https://.../music.mp3")
         negative_prompt = st.text_area("Negative Prompt", "blurry, low quality, bad anatomy, watermark")
+        hedge = False
+        if output_type == "image":
+            hedge = st.checkbox("Hedge slow requests", help="If a job runs past this model's 95th percentile latency, "
+                                                            "send a duplicate with the same seed and keep whichever finishes first.")
+        optimize_upload = False
+        if image_input_needed:
+            optimize_upload = st.checkbox("Shrink image before upload", value=PIL_AVAILABLE, disabled=not PIL_AVAILABLE,
+                                          help="Resize the start image to what the model uses and re-encode it without "
+                                               "metadata before uploading it (requires Pillow).")
         custom_api_key = st.text_input("Enter your fal.ai API Key (optional)", type="password")
+        pool = get_client_pool().stats()
+        if pool["hit_rate"] is not None:
+            st.caption(f"fal connections: {pool['clients']} pooled client(s), {pool['hit_rate']:.0%} reused "
+                       f"({pool['hits']} hits, {pool['misses']} misses, {pool['evictions']} evicted).")
 
     api_key_to_use = custom_api_key if custom_api_key else DEFAULT_FAL_KEY
+
+    # --- Sweep Ranges ---
+    sweep_axes = {}
+    if run_mode == "Sweep":
+        st.subheader("Sweep Ranges")
+        st.caption("Every combination of the values below is generated once. Leave a field empty to keep the setting above.")
+        try:
+            if model_type == "image-to-image":
+                sweep_axes["strength"] = parse_values(st.text_input("Strength values", "0.3, 0.5, 0.7, 0.9"))
+            if "video" in model_type:
+                sweep_axes["resolution"] = st.multiselect("Resolutions", RESOLUTIONS, default=[resolution])
+            if model_type == "text-to-video":
+                sweep_axes["duration"] = st.multiselect("Video Lengths (s)", [*range(3, 11)], default=[duration])
+            sweep_axes["seed"] = parse_values(st.text_input("Seeds", "" if seed == -1 else str(seed),
+                                                            help="Empty uses one random seed for the whole grid."), int)
+        except ValueError:
+            st.error("Sweep values must be comma-separated numbers.")
+            sweep_axes = {"seed": []}
+        if any(not 0.0 <= value <= 1.0 for value in sweep_axes.get("strength", [])):
+            st.error("Strength values must be between 0 and 1.")
+            sweep_axes["strength"] = []
+        sweep_axes = {name: values for name, values in sweep_axes.items() if values or name == "seed"}
     st.divider()
 
+    # Start preparing and uploading the image now so Generate only has to wait for what is left of it
+    upload_size = None
+    if optimize_upload:
+        sizes = [input_size(model_type, res) for res in sweep_axes.get("resolution") or [resolution]]
+        upload_size = (max(width for width, _ in sizes), max(height for _, height in sizes))
+    if st.session_state.uploaded_file_data and ":" in api_key_to_use:
+        file_info = st.session_state.uploaded_file_data
+        try:
+            st.session_state.upload_prefetcher.prefetch(read_upload(file_info["digest"], upload_sources),
+                                                        file_info["type"], api_key_to_use, file_info["digest"], upload_size)
+        except FileNotFoundError:
+            st.session_state.uploaded_file_data = None  # Collected and not in the uploader to store again
+    elif not st.session_state.uploaded_file_data:
+        st.session_state.upload_prefetcher.cancel()
+
     # --- Generation Button and Logic ---
-    if st.button(f"🚀 Generate {output_type.capitalize()}", use_container_width=True, type="primary"):
+    if run_mode == "Batch":
+        job_count = len(prompts) * seeds_per_prompt * max(1, len(batch_images))
+    elif run_mode == "Sweep":
+        job_count = 1
+        for name, values in sweep_axes.items():
+            job_count *= len(values) or (1 if name == "seed" else 0)
+    else:
+        job_count = 1
+    button_label = f"🚀 Generate {output_type.capitalize()}" if run_mode == "Single" else f"🚀 Generate {job_count} {output_type.capitalize()}s"
+    if st.button(button_label, use_container_width=True, type="primary"):
         if not api_key_to_use or ":" not in api_key_to_use:
             st.error("Please provide a valid fal.ai API key in the advanced settings.")
-        elif image_input_needed and not st.session_state.uploaded_file_data and not image_url_from_input:
+        elif image_input_needed and not st.session_state.uploaded_file_data and not batch_images and not image_url_from_input:
             st.error("This mode requires a starting image. Please upload one or provide a URL.")
-        elif not prompt:
+        elif not prompts or not prompts[0]:
             st.error("A prompt is required.")
+        elif job_count == 0:
+            st.error("Each sweep range needs at least one value.")
         else:
             try:
-                os.environ['FAL_KEY'] = api_key_to_use
-                final_image_url = image_url_from_input
+                image_urls = [image_url_from_input]
 
                 with st.spinner("Preparing assets..."):
-                    if st.session_state.uploaded_file_data:
+                    if batch_images:
+                        files = [(read_upload(image["digest"], upload_sources), image["type"]) for image in batch_images]
+                        image_urls = upload_many(files, api_key_to_use, upload_size,
+                                                 digests=[image["digest"] for image in batch_images])
+                    elif st.session_state.uploaded_file_data:
                         file_info = st.session_state.uploaded_file_data
-                        final_image_url = upload_image_to_fal(file_info["data"], file_info["type"], api_key_to_use)
-
-                with st.spinner(f"Generating with `{model_id}`... This may take a minute."):
-                    # Base arguments for all models
-                    api_args = {"prompt": prompt}
-                    if negative_prompt:
-                        api_args["negative_prompt"] = negative_prompt
-                    if seed != -1:
-                        api_args["seed"] = seed
-
-                    # Model-specific arguments
-                    if model_type == "text-to-video":
-                        api_args.update({
-                            "aspect_ratio": "16:9" if "16:9" in resolution else "9:16" if "9:16" in resolution else "1:1",
-                            "resolution": "1080p",
-                            "duration": str(duration),
-                            "enable_safety_checker": False
-                        })
-                        if audio_url:  # Fixed: removed 'audio_url' in locals() check
-                            api_args["audio_url"] = audio_url
-                    elif model_type == "image-to-video":
-                        width, height = map(int, resolution.split('x')[0:2])  # Fixed: handle resolution parsing better
-                        api_args.update({
-                            "image_url": final_image_url, 
-                            "width": width, 
-                            "height": height,
-                            "enable_safety_checker": False  # Added: disable safety checker for image-to-video
-                        })
-                    elif model_type == "image-to-image":
-                        api_args.update({
-                            "image_url": final_image_url, 
-                            "strength": strength,
-                            "enable_safety_checker": False  # Added: disable safety checker for image-to-image
-                        })
-                    elif model_type == "text-to-image":
-                        api_args["enable_safety_checker"] = False  # Added: disable safety checker for text-to-image
-
-                    # Call the API
-                    result = fal_client.subscribe(model_id, arguments=api_args)
-
-                    # Process result
-                    output_data = None
-                    if output_type == "video" and result.get('video'):
-                        output_data = result['video']
-                    elif output_type == "image" and result.get('images'):
-                        output_data = result['images'][0]  # Take the first image
-
-                    if output_data:
-                        st.session_state.results.insert(0, {
-                            "url": output_data['url'],
-                            "type": output_type,
-                            "seed": result.get('seed', 'N/A'),
-                            "prompt": prompt
-                        })
-                        st.success(f"✅ {output_type.capitalize()} generated successfully!")
-                        time.sleep(1)
-                        st.rerun()
+                        image_urls = [st.session_state.upload_prefetcher.result(
+                            read_upload(file_info["digest"], upload_sources), file_info["type"], api_key_to_use,
+                            file_info["digest"], upload_size)]
+
+                # Expand the run into (prompt, setting overrides, label) job specs
+                job_specs = []
+                group = None
+                if run_mode == "Sweep":
+                    if not sweep_axes["seed"]:
+                        sweep_axes["seed"] = [random.randint(0, 2**31 - 1)]  # Same seed across the whole grid
+                    group = f"sweep-{time.time_ns()}"
+                    labels = []
+                    for values in itertools.product(*sweep_axes.values()):
+                        overrides = dict(zip(sweep_axes, values))
+                        label = " · ".join(f"{name}={value}" for name, value in overrides.items())
+                        labels.append(label)
+                        job_specs.append((prompt, overrides, label))
+                    st.session_state.sweeps[group] = {"prompt": prompt, "model_id": model_id, "labels": labels}
+                else:
+                    if run_mode == "Batch":
+                        seeds = [seed + i if seed != -1 else random.randint(0, 2**31 - 1) for i in range(seeds_per_prompt)]
                     else:
-                        st.error("Generation failed. API did not return a valid result.")
-                        st.json(result)
+                        seeds = [seed]
+                    job_specs = [(job_prompt, {"seed": job_seed}, None) for job_prompt in prompts for job_seed in seeds]
+
+                settings = {
+                    "negative_prompt": negative_prompt, "seed": seed, "resolution": resolution,
+                    "duration": duration, "strength": strength, "audio_url": audio_url
+                }
+                job_specs = [(image_url, *spec) for image_url in image_urls for spec in job_specs]
+                submitted = 0
+                for image_url, job_prompt, overrides, label in job_specs:
+                    api_args = build_api_args(model_type, job_prompt, image_url, **{**settings, **overrides})
+                    chain = None
+                    if animate:  # Each still is animated as soon as it finishes, while the others render
+                        chain = chain_template("Image to Video", job_prompt, negative_prompt=negative_prompt,
+                                               seed=overrides.get("seed", seed), resolution=resolution)
+                    job = Job(model_id, api_args, output_type, job_prompt, api_key_to_use,
+                              group=group, label=label, session_id=st.session_state.session_id,
+                              lane=model_config.get("lane"), hedge=hedge, chain=chain)
+                    try:
+                        submit_job(job, max_in_flight=max_concurrent_jobs)
+                    except QueueFullError as e:
+                        st.warning(f"Only {submitted} of {len(job_specs)} job(s) were queued. {e}")
+                        break
+                    st.session_state.pending_jobs.append(job)
+                    submitted += 1
 
+                if submitted:
+                    st.success(f"✅ {submitted} job(s) submitted! Results will appear in the results panel as they finish.")
+
+            except FileNotFoundError:
+                st.error("The starting image is no longer stored. Please upload it again.")
             except Exception as e:
                 st.error(f"An unexpected error occurred: {e}")
 
 with right_col:
     st.header("2. View Results")
     if image_input_needed and st.session_state.uploaded_file_data:
-        st.image(st.session_state.uploaded_file_data["data"], caption="Current Start Image Preview", use_container_width=True)
+        st.image(preview_image(st.session_state.uploaded_file_data["digest"]), caption="Current Start Image Preview", use_container_width=True)
+        prepared = st.session_state.upload_prefetcher.prepared
+        if prepared is not None and prepared.bytes_saved > 0:
+            st.caption(f"Uploaded at {len(prepared.data) / 1024**2:.1f} MB instead of {prepared.original_bytes / 1024**2:.1f} MB "
+                       f"({prepared.bytes_saved / 1024**2:.1f} MB saved, prepared in {prepared.seconds:.2f}s).")
+
+    if st.session_state.pending_jobs:
+        render_pending_jobs()
+
+    # --- Sweep Grids ---
+    for group, sweep in reversed(list(st.session_state.sweeps.items())):
+        by_label = {res["label"]: res for res in st.session_state.results if res.get("group") == group}
+        st.subheader(f"Sweep ({len(by_label)}/{len(sweep['labels'])})")
+        st.caption(f"`{sweep['model_id']}` · Prompt: {sweep['prompt']}")
+        grid = st.columns(min(4, len(sweep["labels"])))
+        for cell, label in enumerate(sweep["labels"]):
+            with grid[cell % len(grid)]:
+                res = by_label.get(label)
+                if res is None:
+                    st.caption(f"⏳ {label}")
+                elif res["type"] == "video":
+                    st.video(res.get("path") or res["url"])
+                    st.caption(label)
+                else:
+                    st.image(res.get("path") or res["url"], caption=label)
+        if st.button("Clear Sweep", key=f"clear_{group}"):
+            del st.session_state.sweeps[group]
+            st.session_state.results = [res for res in st.session_state.results if res.get("group") != group]
+            st.rerun()
+        st.divider()
 
-    if not st.session_state.results:
+    if not st.session_state.results and not st.session_state.pending_jobs:
         st.info("Your generated creations will appear here.")
     else:
         for idx, res in enumerate(st.session_state.results):
+            if res.get("group") in st.session_state.sweeps:
+                continue  # Shown in its sweep grid above
             try:
                 if res["type"] == "video":
-                    st.video(res["url"])
+                    st.video(res.get("path") or res["url"])
                     file_name = f"generated_video_{idx+1}.mp4"
                     mime = "video/mp4"
                 else:  # image
-                    st.image(res["url"])
+                    st.image(res.get("path") or res["url"])
                     file_name = f"generated_image_{idx+1}.png"
                     mime = "image/png"
 
-                st.caption(f"Prompt: {res['prompt']} | Seed: {res['seed']}")
-                
-                # Download file content
-                file_bytes = download_file(res["url"])
-                if file_bytes:  # Only show download button if file was successfully downloaded
+                st.caption(f"Prompt: {res['prompt']} | Seed: {res['seed']}" + (" | ♻️ Cached" if res.get("cached") else ""))
+
+                # Download file content to disk
+                file_path = res.get("path") or download_file(res["url"])
+                if file_path:  # Only show download button if file was successfully downloaded
                     st.download_button(
                         label=f"⬇️ Download {res['type'].capitalize()}",
-                        data=file_bytes,  # Fixed: use file_bytes instead of requests.get
+                        data=lambda path=file_path: read_file(path),
                         file_name=file_name,
                         mime=mime,
                         key=f"download_{idx}",
                         use_container_width=True
                     )
+                animate = res["type"] == "image" and st.button("🎬 Animate this", key=f"animate_{idx}", use_container_width=True)
+                if animate and (not api_key_to_use or ":" not in api_key_to_use):
+                    st.error("Please provide a valid fal.ai API key in the advanced settings.")
+                elif animate:
+                    animation = chain_template("Image to Video", res["prompt"], negative_prompt=negative_prompt,
+                                               resolution=resolution)
+                    job = Job(animation["model_id"], dict(animation["api_args"], image_url=res["url"]),
+                              animation["output_type"], res["prompt"], api_key_to_use,
+                              session_id=st.session_state.session_id, lane=animation["lane"])
+                    try:
+                        submit_job(job)
+                        st.session_state.pending_jobs.append(job)
+                        st.rerun()
+                    except QueueFullError as e:
+                        st.warning(str(e))
                 st.divider()
             except Exception as e:
                 st.error(f"Error displaying result {idx+1}: {e}")
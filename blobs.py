@@ -0,0 +1,86 @@
+# blobs.py
+# Content-addressed, disk-backed store for uploaded files.
+# Sessions keep only a file's digest; the bytes are written here once, however
+# many sessions hold the same file, and read back through a memory map so they
+# are paged in from the OS page cache instead of living in every session.
+
+import hashlib
+import mmap
+import os
+import threading
+import time
+
+from eviction import EVICT_INTERVAL, select_evictions
+
+def content_digest(file_data) -> str:
+    """Identifies file contents, e.g. to tell whether a newly selected file differs from the last one."""
+    return hashlib.blake2b(file_data, digest_size=20).hexdigest()
+
+class BlobStore:
+    """Files stored as `<directory>/<digest[:2]>/<digest>`.
+
+    Storing or reading a blob bumps its mtime; blobs unused for `ttl` seconds
+    are deleted, then the least recently used ones while the store is over
+    `max_bytes`. A blob that is deleted while mapped stays readable through
+    the existing map.
+    """
+
+    def __init__(self, directory: str, ttl: float = 24 * 3600, max_bytes: int = 5 * 1024**3):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._last_evict = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def has(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def put(self, file_data) -> str:
+        """Stores bytes (or any buffer) and returns their digest; existing contents are not rewritten."""
+        digest = content_digest(file_data)
+        path = self.path(digest)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(file_data)
+            os.replace(tmp, path)
+        if time.time() - self._last_evict > EVICT_INTERVAL:
+            self._evict()
+        return digest
+
+    def read(self, digest: str) -> mmap.mmap | bytes:
+        """Maps a blob read-only; raises FileNotFoundError once it has been collected."""
+        path = self.path(digest)
+        with open(path, "rb") as f:
+            os.utime(path)
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""  # Empty files cannot be mapped
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _evict(self):
+        """One garbage collection pass (see eviction.py)."""
+        with self._lock:
+            self._last_evict = time.time()
+            blobs = []
+            for shard in os.scandir(self.directory):
+                if shard.is_dir():
+                    for entry in os.scandir(shard.path):
+                        if not entry.name.endswith(".tmp"):
+                            stat = entry.stat()
+                            blobs.append((stat.st_mtime, stat.st_size, entry.path))
+            for path in select_evictions(blobs, self.ttl, self.max_bytes, self._last_evict):
+                self._remove(path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,93 @@
+# cache.py
+# Persistent, content-addressed cache of fal.ai results.
+# Entries are keyed by jobs.request_key(), so only requests with an explicit
+# seed (and therefore a deterministic output) are worth caching.
+
+import json
+import os
+import threading
+import time
+
+import requests
+
+from downloads import download
+from eviction import EVICT_INTERVAL, select_evictions
+
+class ResultCache:
+    """On-disk result cache with a TTL and least-recently-used eviction by total size.
+
+    Each entry is `<key>.json` holding the result payload, plus an optional
+    `<key>.media` copy of the output file so the entry stays usable after the
+    fal.ai URL expires. Reading an entry bumps its mtime, which is the LRU clock.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 2 * 1024**3, ttl: float = 7 * 24 * 3600,
+                 store_media: bool = False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.store_media = store_media
+        self._lock = threading.Lock()
+        self._last_evict = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{key}{suffix}")
+
+    def get(self, key: str) -> dict | None:
+        """Returns the cached entry (`result`, `created_at`, `media_path`) or None."""
+        path = self._path(key, ".json")
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry["created_at"] > self.ttl:
+            self.delete(key)
+            return None
+        media_path = self._path(key, ".media")
+        entry["media_path"] = media_path if os.path.exists(media_path) else None
+        for touched in (path, entry["media_path"]):
+            if touched:
+                os.utime(touched)
+        return entry
+
+    def put(self, key: str, model_id: str, result: dict, media_url: str | None = None):
+        """Stores a result, downloading its media too when `store_media` is on."""
+        if self.store_media and media_url:
+            media_path = self._path(key, ".media")
+            try:
+                download(media_url, media_path)
+            except (OSError, requests.RequestException):
+                for leftover in (media_path + ".part", media_path + ".part.json"):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)  # The entry still works while the fal.ai URL lives
+
+        tmp = self._path(key, f".json.{threading.get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"model_id": model_id, "created_at": time.time(), "result": result}, f)
+        os.replace(tmp, self._path(key, ".json"))
+        if time.time() - self._last_evict > EVICT_INTERVAL:
+            self._evict()
+
+    def delete(self, key: str):
+        for suffix in (".json", ".media"):
+            try:
+                os.remove(self._path(key, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _evict(self):
+        """One garbage collection pass over whole entries, result and media together (see eviction.py)."""
+        with self._lock:
+            self._last_evict = time.time()
+            entries = {}
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith((".json", ".media")):
+                    key = entry.name.rsplit(".", 1)[0]
+                    stat = entry.stat()
+                    size, used = entries.get(key, (0, 0))
+                    entries[key] = (size + stat.st_size, max(used, stat.st_mtime))
+            candidates = [(used, size, key) for key, (size, used) in entries.items()]
+            for key in select_evictions(candidates, self.ttl, self.max_bytes, self._last_evict):
+                self.delete(key)
@@ -0,0 +1,171 @@
+# cli.py
+# Headless batch runner.
+# Reads a JSONL or CSV manifest with one generation per row, builds the
+# request arguments exactly like the Streamlit app and runs the jobs
+# concurrently, appending one JSON line per finished row to the output file.
+#
+#   python cli.py manifest.jsonl --output results.jsonl --media-dir media/ --concurrency 4
+#
+# Media is downloaded on a pool of its own (--download-concurrency), so a large
+# video does not hold up submitting or recording the other rows.
+#
+# Manifest columns: mode (a MODELS key such as "Text to Image", or a model type
+# such as "image-to-video"), prompt, and optionally id, negative_prompt, seed,
+# resolution, duration, strength, image (local path or URL) and audio_url.
+# Rerunning with the same output file skips rows that already completed.
+
+import argparse
+import csv
+import hashlib
+import json
+import mimetypes
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from downloads import download, url_extension
+from jobs import Job, JobScheduler, QueueFullError
+from models import job_from_spec, resolve_mode
+from records import read_records
+from services import create_result_cache, lanes_from_env
+from uploads import resolve_image, upload_many
+
+# ---------------------------
+# Manifest Handling
+# ---------------------------
+def read_manifest(path: str) -> list[dict]:
+    """Loads manifest rows from a .jsonl or .csv file, dropping empty CSV cells."""
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            return [{k: v for k, v in row.items() if v not in (None, "")} for row in csv.DictReader(f)]
+        return [json.loads(line) for line in f if line.strip()]
+
+def row_id(row: dict) -> str:
+    """The row's own id, or a hash of its contents so reruns recognise it."""
+    if row.get("id"):
+        return str(row["id"])
+    return hashlib.sha256(json.dumps(row, sort_keys=True).encode()).hexdigest()[:16]
+
+def completed_ids(output_path: str) -> set[str]:
+    """Ids of rows that already completed in a previous run (whose last record may have been cut short)."""
+    return {record["id"] for record in read_records(output_path) if record["status"] == "Completed"}
+
+# ---------------------------
+# Helper Functions
+# ---------------------------
+def upload_local_images(rows: list[dict], api_key: str, uploaded: dict):
+    """Uploads every distinct local image in the manifest up front, several at a time."""
+    paths = sorted({row["image"] for row in rows if row.get("image") and os.path.isfile(row["image"])})
+    files = []
+    for path in paths:
+        with open(path, "rb") as f:
+            files.append((f.read(), mimetypes.guess_type(path)[0] or "image/png"))
+    uploaded.update(zip(paths, upload_many(files, api_key)))
+
+def download_media(url: str, directory: str, name: str) -> str:
+    """Streams a result file into `directory` and returns its path; a rerun resumes a partial download."""
+    return download(url, os.path.join(directory, name + url_extension(url)))
+
+def build_job(row: dict, api_key: str, uploaded: dict) -> Job:
+    """Turns a manifest row into a Job using the same settings and defaults as the app."""
+    config = resolve_mode(row["mode"])
+    image_url = None
+    if config["type"] in ["image-to-video", "image-to-image"]:
+        if not row.get("image"):
+            raise ValueError("This mode requires an 'image' path or URL.")
+        image_url = resolve_image(row["image"], api_key, uploaded)
+    return job_from_spec(row, api_key, image_url, session_id="cli")
+
+# ---------------------------
+# Entry Point
+# ---------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Runs a manifest of fal.ai generations without the UI.")
+    parser.add_argument("manifest", help="Path to a .jsonl or .csv manifest.")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL file results are appended to.")
+    parser.add_argument("--media-dir", help="Download each result's media into this directory.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum generations in flight at once.")
+    parser.add_argument("--download-concurrency", type=int,
+                        help="Maximum media downloads at once (default: --concurrency).")
+    parser.add_argument("--api-key", default=os.environ.get("FAL_KEY"), help="fal.ai API key (default: $FAL_KEY).")
+    args = parser.parse_args()
+
+    if not args.api_key or ":" not in args.api_key:
+        parser.error("A valid fal.ai API key is required (--api-key or FAL_KEY).")
+    if args.media_dir:
+        os.makedirs(args.media_dir, exist_ok=True)
+
+    rows = read_manifest(args.manifest)
+    done_ids = completed_ids(args.output)
+    scheduler = JobScheduler(lanes_from_env(min_in_flight=args.concurrency), cache=create_result_cache())
+    uploaded = {}
+    running = {}    # row id -> (row, job)
+    finishing = {}  # future of write() -> row id, while its media downloads
+    failures = skipped = 0
+    output_lock = threading.Lock()
+
+    with open(args.output, "a", encoding="utf-8") as output, \
+            ThreadPoolExecutor(max_workers=args.download_concurrency or args.concurrency,
+                               thread_name_prefix="download") as downloads:
+        def write(rid: str, row: dict, job: Job | None, error: str | None = None) -> dict:
+            """Downloads the row's media if asked to, then appends its record; runs on the download pool."""
+            record = {"id": rid, "row": row, "status": job.status if job else "Failed", "error": error}
+            if job is not None:
+                record.update(model_id=job.model_id, request_id=job.request_id, seed=job.seed,
+                              url=job.output["url"] if job.output else None, cached=job.cached, error=job.error)
+                if job.status == "Completed" and args.media_dir:
+                    try:
+                        record["file"] = download_media(record["url"], args.media_dir, rid)
+                    except (OSError, requests.RequestException) as e:
+                        record.update(status="Failed", error=f"Download failed: {e}")
+            with output_lock:
+                output.write(json.dumps(record) + "\n")
+                output.flush()
+            return record
+
+        pending_rows = [row for row in rows if row_id(row) not in done_ids]
+        try:
+            upload_local_images(pending_rows, args.api_key, uploaded)
+        except Exception as e:
+            print(f"Could not upload all images up front ({e}); retrying them row by row.", file=sys.stderr)
+
+        waiting = []  # (row id, row, job) not yet accepted by the scheduler
+        for row in rows:
+            rid = row_id(row)
+            if rid in done_ids or rid in {queued[0] for queued in waiting}:
+                skipped += 1
+                continue
+            try:
+                waiting.append((rid, row, build_job(row, args.api_key, uploaded)))
+            except Exception as e:
+                failures += write(rid, row, None, str(e))["status"] != "Completed"
+
+        print(f"{len(waiting)} job(s) to run, {skipped} already complete or duplicated, {failures} invalid.", file=sys.stderr)
+        while waiting or running or finishing:
+            while waiting:
+                rid, row, job = waiting[0]
+                try:
+                    running[rid] = (row, scheduler.submit(job, max_in_flight=args.concurrency))
+                except QueueFullError:
+                    break  # Submitted once running jobs drain the lane
+                waiting.pop(0)
+            for rid, (row, job) in list(running.items()):
+                if job.done:
+                    del running[rid]
+                    finishing[downloads.submit(write, rid, row, job)] = rid
+            for future in [future for future in finishing if future.done()]:
+                rid = finishing.pop(future)
+                record = future.result()
+                ok = record["status"] == "Completed"
+                failures += not ok
+                print(f"[{'ok' if ok else 'failed'}] {rid}: {record['error'] or record['url']}", file=sys.stderr)
+            time.sleep(0.5)
+
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
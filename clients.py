@@ -0,0 +1,85 @@
+# clients.py
+# Shared fal.ai clients.
+# A fal_client.SyncClient keeps an HTTP connection pool (and its TLS sessions)
+# for the lifetime of the object, so one client per API key is kept and reused
+# by every upload and inference call in the process instead of building a new
+# one per call.
+
+import threading
+import time
+from collections import OrderedDict
+
+import fal_client
+
+from ratelimit import throttle_hook
+
+class ClientPool:
+    """Process-wide SyncClients by API key, bounded in size and dropped once idle.
+
+    Clients idle for `idle_ttl` seconds are closed. When more than `max_size`
+    keys are in use, the least recently used client is dropped without being
+    closed (a call may still be using it) and left to the garbage collector.
+    """
+
+    def __init__(self, max_size: int = 32, idle_ttl: float = 300):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._clients: OrderedDict[str, tuple[fal_client.SyncClient, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, api_key: str) -> fal_client.SyncClient:
+        """The key's client, created on first use."""
+        with self._lock:
+            now = time.monotonic()
+            self._evict_idle(now)
+            if api_key in self._clients:
+                client = self._clients[api_key][0]
+                self.hits += 1
+            else:
+                client = fal_client.SyncClient(key=api_key)
+                install_throttle_hook(client, api_key)
+                self.misses += 1
+            self._clients[api_key] = (client, now)
+            self._clients.move_to_end(api_key)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+                self.evictions += 1
+            return client
+
+    def _evict_idle(self, now: float):
+        while self._clients:
+            api_key, (client, last_used) = next(iter(self._clients.items()))
+            if now - last_used < self.idle_ttl:
+                break
+            del self._clients[api_key]
+            self.evictions += 1
+            http_client = getattr(client, "_client", None)
+            if http_client is not None:
+                http_client.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"clients": len(self._clients), "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "hit_rate": self.hits / lookups if lookups else None}
+
+def install_throttle_hook(client: fal_client.SyncClient, api_key: str):
+    """Reports 429s to the key's limiter as they happen, including those fal_client retries itself.
+
+    Relies on the httpx client fal_client keeps in its private `_client`
+    (fal-client 1.x). Without it, throttling is still reported by
+    call_with_retry once fal_client gives up.
+    """
+    http_client = getattr(client, "_client", None)
+    hooks = getattr(http_client, "event_hooks", None)
+    if isinstance(hooks, dict):
+        hooks.setdefault("response", []).append(throttle_hook(api_key))
+
+CLIENTS = ClientPool()
+
+def get_client(api_key: str) -> fal_client.SyncClient:
+    """Returns the process-wide client for an API key."""
+    return CLIENTS.get(api_key)
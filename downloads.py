@@ -0,0 +1,118 @@
+# downloads.py
+# Streaming, resumable downloads of result media.
+# Files are written chunk by chunk to `<path>.part`, so memory use stays flat
+# however large the video. An interrupted transfer resumes from where it
+# stopped with an HTTP Range request. If-Range makes sure the remote file has
+# not changed in the meantime, and the final size is checked against what the
+# server announced.
+
+import hashlib
+import json
+import os
+import time
+
+import requests
+
+CHUNK_SIZE = 1024 * 1024
+PRUNE_INTERVAL = 300  # Seconds between pruning passes over a download directory
+
+_last_prune: dict[str, float] = {}  # Directory -> time of its last pruning pass
+
+class IncompleteDownload(IOError):
+    pass
+
+def _transient(error: Exception) -> bool:
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout,
+                              requests.exceptions.ChunkedEncodingError, IncompleteDownload))
+
+def download(url: str, path: str, attempts: int = 4, timeout: float = 60) -> str:
+    """Streams `url` into `path` (unless it is already there) and returns the path."""
+    if os.path.exists(path):
+        os.utime(path)  # Keeps reused downloads from being pruned
+        return path
+    part, meta_path = path + ".part", path + ".part.json"
+    for attempt in range(attempts):
+        try:
+            _fetch(url, part, meta_path, timeout)
+            os.replace(part, path)
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+            return path
+        except (OSError, requests.RequestException) as e:
+            if attempt == attempts - 1 or not _transient(e):
+                raise
+            time.sleep(min(2 ** attempt, 10))
+
+def _fetch(url: str, part: str, meta_path: str, timeout: float):
+    """One attempt: resumes `part` if it can be validated, otherwise starts over."""
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    meta = {}
+    if offset and os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+    headers = {}
+    if offset and meta.get("validator"):
+        headers = {"Range": f"bytes={offset}-", "If-Range": meta["validator"]}
+
+    with requests.get(url, stream=True, timeout=timeout, headers=headers) as response:
+        if response.status_code == 416:  # Nothing left to fetch, or the file changed; start over
+            os.remove(part)
+            raise IncompleteDownload("The server rejected the resume range.")
+        response.raise_for_status()
+        if response.status_code == 206:
+            start, total = _content_range(response.headers.get("Content-Range", ""))
+            if start != offset:
+                os.remove(part)
+                raise IncompleteDownload(f"The server resumed at byte {start} instead of {offset}.")
+            mode = "ab"
+        else:  # A full response: no partial file yet, no validator, or the remote file changed
+            length = response.headers.get("Content-Length")
+            total = int(length) if length and not response.headers.get("Content-Encoding") else None
+            meta = {"validator": response.headers.get("ETag") or response.headers.get("Last-Modified"), "total": total}
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            mode = "wb"
+        with open(part, mode) as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+
+    size = os.path.getsize(part)
+    if total is not None and size != total:
+        raise IncompleteDownload(f"Received {size} of {total} bytes.")
+
+def _content_range(value: str) -> tuple[int, int | None]:
+    """"bytes 100-999/1000" -> (100, 1000)"""
+    unit_range, _, total = value.partition("/")
+    start = int(unit_range.split()[-1].split("-")[0])
+    return start, int(total) if total.isdigit() else None
+
+def url_extension(url: str) -> str:
+    """The file extension of a URL's path, e.g. ".mp4" (".bin" if it has none)."""
+    return os.path.splitext(url.split("?")[0])[1] or ".bin"
+
+def download_to(directory: str, url: str, attempts: int = 4, max_age: float | None = None) -> str:
+    """Downloads a URL into `directory` under a name derived from the URL, reusing earlier downloads.
+
+    With `max_age`, files in `directory` unused for that long are pruned, at
+    most once every PRUNE_INTERVAL seconds.
+    """
+    os.makedirs(directory, exist_ok=True)
+    if max_age is not None and time.time() - _last_prune.get(directory, 0.0) > PRUNE_INTERVAL:
+        _last_prune[directory] = time.time()
+        prune(directory, max_age)
+    name = hashlib.sha256(url.encode()).hexdigest()[:32] + url_extension(url)
+    return download(url, os.path.join(directory, name), attempts=attempts)
+
+def prune(directory: str, max_age: float):
+    """Deletes downloads (and abandoned partial files) not touched for `max_age` seconds."""
+    if not os.path.isdir(directory):
+        return
+    now = time.time()
+    for entry in os.scandir(directory):
+        try:
+            if entry.is_file() and now - entry.stat().st_mtime > max_age:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass  # Removed by a concurrent pass
@@ -0,0 +1,26 @@
+# eviction.py
+# The garbage collection policy shared by the on-disk stores (result cache,
+# blob store): entries unused for longer than a TTL go first, then the least
+# recently used ones until the store fits its size budget. Stores run a pass
+# at most once every EVICT_INTERVAL seconds, so writes do not rescan the
+# directory every time.
+
+EVICT_INTERVAL = 300  # Seconds between garbage collection passes
+
+def select_evictions(entries: list[tuple[float, int, object]], ttl: float, max_bytes: int, now: float) -> list:
+    """Picks what to delete from `(last_used, size, item)` entries: expired items, then the LRU ones over `max_bytes`."""
+    evicted = []
+    kept = []
+    total = 0
+    for used, size, item in entries:
+        if now - used > ttl:
+            evicted.append(item)
+        else:
+            kept.append((used, size, item))
+            total += size
+    for used, size, item in sorted(kept, key=lambda entry: entry[0]):
+        if total <= max_bytes:
+            break
+        evicted.append(item)
+        total -= size
+    return evicted
@@ -0,0 +1,498 @@
+# jobs.py
+# Background execution of fal.ai generation jobs.
+# A Job is submitted to the fal queue and polled to completion on a worker
+# thread, so the Streamlit script thread only ever reads its status.
+
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import fal_client
+
+from clients import get_client
+from ratelimit import RetryBudget, call_with_retry, get_limiter
+
+# ---------------------------
+# Job Model
+# ---------------------------
+@dataclass
+class Job:
+    """A single generation request and its progress through the fal queue."""
+    model_id: str
+    api_args: dict
+    output_type: str
+    prompt: str
+    api_key: str = field(repr=False)
+    group: str | None = None   # Sweep the job belongs to, if any
+    label: str | None = None   # Sweep settings, e.g. "strength=0.5 · seed=42"
+    session_id: str = "default"
+    lane: str | None = None    # Scheduling lane; defaults to the output type
+    max_retries: int = 5       # Retry budget shared by all of the job's fal calls
+    retries: int = 0
+    hedge: bool = False        # Race a duplicate request once the model's p95 latency has passed
+    hedged: bool = False
+    hedge_request_ids: list = field(default_factory=list)  # Duplicates still racing request_id, cancelled once one wins
+    chain: dict | None = field(default=None, repr=False)   # Follow-up job fed with this job's output URL
+    child_id: str | None = None  # Id of the follow-up job once it has been created
+    leader: "Job | None" = field(default=None, repr=False)  # Identical in-flight job this one is attached to
+    followers: list | None = field(default_factory=list, repr=False)  # None once the job has finished
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "Pending"    # Pending, Attached, Submitted, Queued, In progress, Retrying, Completed or Failed
+    position: int | None = None  # 1-based place in fal.ai's queue while Queued
+    note: str | None = None      # Detail for the current status, e.g. why a retry is happening
+    logs: list = field(default_factory=list, repr=False)    # Most recent model log lines
+    events: list = field(default_factory=list, repr=False)  # (status, timestamp) for every transition
+    request_id: str | None = None
+    output: dict | None = None
+    seed: object = "N/A"
+    error: str | None = None
+    raw_result: dict | None = None
+    result: dict | None = field(default=None, repr=False)
+    cached: bool = False       # Served from the result cache without calling fal.ai
+    submitted_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+    listener: object = field(default=None, repr=False)  # Called with the job after every change, e.g. JobJournal.record
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("Completed", "Failed")
+
+    def update(self, **changes):
+        """Applies field changes and reports them to the listener if anything changed.
+
+        Status changes are also timestamped in `events` for latency analysis.
+        """
+        if all(getattr(self, name) == value for name, value in changes.items()):
+            return
+        if changes.get("status", self.status) != self.status:
+            self.events.append((changes["status"], time.time()))
+        for name, value in changes.items():
+            setattr(self, name, value)
+        if self.listener is not None:
+            self.listener(self)
+
+    def attach(self, follower: "Job") -> bool:
+        """Makes `follower` share this job's outcome; False if this job has already finished."""
+        with _FOLLOWERS_LOCK:
+            if self.followers is None:
+                return False
+            self.followers.append(follower)
+            follower.leader = self
+            follower.update(status="Attached")
+            return True
+
+    def adopt(self, leader: "Job"):
+        """Copies a finished leader's outcome onto this follower."""
+        self.update(request_id=leader.request_id, output=leader.output, seed=leader.seed, error=leader.error,
+                    raw_result=leader.raw_result, result=leader.result, finished_at=leader.finished_at,
+                    status=leader.status)
+
+_FOLLOWERS_LOCK = threading.Lock()
+
+# ---------------------------
+# Latency Tracking
+# ---------------------------
+class LatencyTracker:
+    """Rolling window of recent end-to-end request latencies per model."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: dict[str, deque] = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def record(self, model_id: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(model_id, deque(maxlen=self._window)).append(seconds)
+
+    def percentile(self, model_id: str, q: float) -> float | None:
+        """The q-th percentile latency, or None until enough samples have been seen."""
+        with self._lock:
+            samples = sorted(self._samples.get(model_id, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q / 100 * len(samples)))]
+
+LATENCY = LatencyTracker()
+
+# ---------------------------
+# Helper Functions
+# ---------------------------
+LOG_LINES = 50  # Log lines kept per job
+
+def request_key(model_id: str, api_args: dict) -> str:
+    """Canonical key for a request: the same model and arguments always hash the same."""
+    args = {name: value for name, value in api_args.items() if value is not None}
+    canonical = json.dumps({"model": model_id, "args": args}, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def extract_output(result: dict, output_type: str):
+    """Picks the video or first image out of a fal.ai result payload."""
+    if output_type == "video" and result.get('video'):
+        return result['video']
+    if output_type == "image" and result.get('images'):
+        return result['images'][0]  # Take the first image
+    return None
+
+def run_job(job: Job, poll_interval: float = 1.0, lane: "Lane | None" = None) -> Job:
+    """Submits a job and blocks until it finishes, updating its status as it goes.
+
+    A job that already has a request_id (one reattached from the journal) is
+    not resubmitted; polling simply picks up where it left off, including on
+    any hedge duplicates it had started. Hedges count against `lane`'s
+    per-key cap while they run.
+    """
+    limiter = get_limiter(job.api_key)
+    budget = RetryBudget(job.max_retries)
+
+    def on_retry(attempt, delay, error):
+        job.update(retries=job.retries + 1, note=f"in {delay:.0f}s after: {error}", status="Retrying")
+
+    def call(method, *args, **kwargs):
+        # Looked up per call so a long-running job keeps its pooled client from going idle
+        fn = getattr(get_client(job.api_key), method)
+        return call_with_retry(fn, *args, limiter=limiter, budget=budget, on_retry=on_retry,
+                               idempotent=method != "submit", **kwargs)
+
+    # A hedge duplicates the request, so both copies need the same explicit seed
+    hedge_delay = LATENCY.percentile(job.model_id, 95) if job.hedge and job.output_type == "image" else None
+    if hedge_delay is not None and "seed" not in job.api_args:
+        job.api_args["seed"] = random.randint(0, 2**31 - 1)
+
+    reserved = 0  # Hedge slots taken from the lane
+    try:
+        if job.request_id:
+            started = {request_id: job.submitted_at for request_id in [job.request_id] + job.hedge_request_ids}
+            if lane is not None:
+                for _ in job.hedge_request_ids:
+                    lane.reserve_extra(job, force=True)
+                    reserved += 1
+        else:
+            handle = call("submit", job.model_id, arguments=job.api_args)
+            job.update(request_id=handle.request_id, status="Submitted")
+            started = {handle.request_id: time.time()}
+        request_ids = [job.request_id] + job.hedge_request_ids
+        winner = None
+
+        while winner is None:
+            for request_id in list(request_ids):
+                primary = request_id == request_ids[0]
+                status = call("status", job.model_id, request_id, with_logs=primary)
+                if not isinstance(status, fal_client.Completed):
+                    if primary and isinstance(status, fal_client.Queued):
+                        job.update(position=status.position + 1, note=None, status="Queued")
+                    elif primary:
+                        logs = [entry.get("message", "") for entry in status.logs or []][-LOG_LINES:]
+                        job.update(position=None, note=None, logs=logs or job.logs, status="In progress")
+                elif status.error:
+                    request_ids.remove(request_id)
+                    if not request_ids:
+                        raise RuntimeError(status.error)
+                    if request_id in job.hedge_request_ids:
+                        job.update(hedge_request_ids=[rid for rid in job.hedge_request_ids if rid != request_id])
+                else:
+                    winner = request_id
+                    break
+
+            if winner is None:
+                if (hedge_delay is not None and not job.hedged and time.time() - started[job.request_id] > hedge_delay
+                        and (lane is None or lane.reserve_extra(job))):
+                    reserved += lane is not None
+                    duplicate = call("submit", job.model_id, arguments=job.api_args)
+                    started[duplicate.request_id] = time.time()
+                    request_ids.append(duplicate.request_id)
+                    job.update(hedged=True, hedge_request_ids=job.hedge_request_ids + [duplicate.request_id])
+                time.sleep(poll_interval)
+
+        # Whichever copy finished first wins; the other is cancelled so it stops costing queue time
+        for request_id in request_ids:
+            if request_id != winner:
+                try:
+                    get_client(job.api_key).cancel(job.model_id, request_id)
+                except Exception:
+                    pass
+        job.update(request_id=winner, hedge_request_ids=[])
+        LATENCY.record(job.model_id, time.time() - started[winner])
+
+        result = call("result", job.model_id, job.request_id)
+        output_data = extract_output(result, job.output_type)
+        if output_data:
+            job.update(result=result, output=output_data, seed=result.get('seed', 'N/A'),
+                       finished_at=time.time(), status="Completed")
+        else:
+            job.update(result=result, raw_result=result, error="API did not return a valid result.",
+                       finished_at=time.time(), status="Failed")
+    except Exception as e:
+        for request_id in job.hedge_request_ids:  # The job has failed; stop paying for its duplicates
+            try:
+                get_client(job.api_key).cancel(job.model_id, request_id)
+            except Exception:
+                pass
+        job.update(error=str(e), hedge_request_ids=[], finished_at=time.time(), status="Failed")
+    finally:
+        for _ in range(reserved):
+            lane.release_extra(job)
+        with _FOLLOWERS_LOCK:
+            followers, job.followers = job.followers, None
+        for follower in followers:
+            follower.adopt(job)
+    return job
+
+# ---------------------------
+# Shared Scheduler
+# ---------------------------
+class QueueFullError(RuntimeError):
+    """Raised when a lane already holds its maximum number of waiting jobs."""
+
+@dataclass
+class LaneConfig:
+    max_in_flight: int = 8
+    max_in_flight_per_key: int = 4
+    max_queued: int = 200
+
+DEFAULT_LANES = {
+    "image": LaneConfig(max_in_flight=8, max_in_flight_per_key=4, max_queued=200),
+    "video": LaneConfig(max_in_flight=4, max_in_flight_per_key=2, max_queued=50),
+}
+
+class Lane:
+    """One scheduling lane with its own queue, workers and concurrency caps.
+
+    Jobs wait in one queue per session and are dispatched round-robin across
+    sessions, so a large batch from one user cannot starve everyone else.
+    A job only starts while the lane's global, per-API-key and per-session
+    in-flight counts are below their caps.
+    """
+
+    def __init__(self, name: str, config: LaneConfig, runner=run_job):
+        self.name = name
+        self.runner = runner
+        self.max_in_flight = config.max_in_flight
+        self.max_in_flight_per_key = config.max_in_flight_per_key
+        self.max_queued = config.max_queued
+        self._cond = threading.Condition()
+        self._queues: dict[str, deque] = {}   # session_id -> waiting jobs, in round-robin order
+        self._session_limits: dict[str, int] = {}
+        self._in_flight = 0
+        self._in_flight_by_key = Counter()
+        self._in_flight_by_session = Counter()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix=f"fal-{name}")
+        threading.Thread(target=self._dispatch_loop, name=f"fal-{name}-dispatcher", daemon=True).start()
+
+    def submit(self, job: Job, max_in_flight: int | None = None) -> Job:
+        """Queues a job; `max_in_flight` caps how many of its session's jobs run at once."""
+        with self._cond:
+            if sum(len(queue) for queue in self._queues.values()) >= self.max_queued:
+                raise QueueFullError(f"The {self.name} queue is full ({self.max_queued} jobs waiting). Try again shortly.")
+            if max_in_flight is not None:
+                self._session_limits[job.session_id] = max_in_flight
+            self._queues.setdefault(job.session_id, deque()).append(job)
+            self._cond.notify()
+        return job
+
+    def depth(self) -> int:
+        """Number of jobs waiting for a slot in this lane across all sessions."""
+        with self._cond:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def position(self, job: Job) -> int | None:
+        """1-based place of a waiting job in dispatch order, or None once it has started."""
+        with self._cond:
+            queues = [list(queue) for queue in self._queues.values()]
+        position = 0
+        for depth in range(max(map(len, queues), default=0)):
+            for queue in queues:
+                if depth < len(queue):
+                    position += 1
+                    if queue[depth] is job:
+                        return position
+        return None
+
+    def reserve_extra(self, job: Job, force: bool = False) -> bool:
+        """Counts an extra request of a running job (a hedge) against its key's cap; False if the key is at it."""
+        with self._cond:
+            if not force and self._in_flight_by_key[job.api_key] >= self.max_in_flight_per_key:
+                return False
+            self._in_flight_by_key[job.api_key] += 1
+            return True
+
+    def release_extra(self, job: Job):
+        with self._cond:
+            self._in_flight_by_key[job.api_key] -= 1
+            self._in_flight_by_key = +self._in_flight_by_key
+            self._cond.notify()
+
+    def _runnable(self, job: Job) -> bool:
+        session_limit = self._session_limits.get(job.session_id, self.max_in_flight)
+        return (self._in_flight < self.max_in_flight
+                and self._in_flight_by_key[job.api_key] < self.max_in_flight_per_key
+                and self._in_flight_by_session[job.session_id] < session_limit)
+
+    def _next_job(self) -> Job | None:
+        """Pops the first runnable session head and moves that session to the back of the rotation."""
+        for session_id, queue in list(self._queues.items()):
+            if self._runnable(queue[0]):
+                job = queue.popleft()
+                del self._queues[session_id]
+                if queue:
+                    self._queues[session_id] = queue
+                return job
+        return None
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+                self._in_flight += 1
+                self._in_flight_by_key[job.api_key] += 1
+                self._in_flight_by_session[job.session_id] += 1
+            self._executor.submit(self._run, job)
+
+    def _run(self, job: Job):
+        try:
+            self.runner(job)
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._in_flight_by_key[job.api_key] -= 1
+                self._in_flight_by_session[job.session_id] -= 1
+                self._in_flight_by_key = +self._in_flight_by_key  # Drop zero counts so idle keys and sessions are forgotten
+                self._in_flight_by_session = +self._in_flight_by_session
+                if job.session_id not in self._in_flight_by_session and job.session_id not in self._queues:
+                    self._session_limits.pop(job.session_id, None)
+                self._cond.notify()
+
+class JobScheduler:
+    """Process-wide job queue shared by every session.
+
+    Work is split into lanes by the job's lane (its model's output type unless
+    the model declares one), so a burst of slow video renders only competes
+    with other video jobs and leaves image latency unaffected.
+    """
+
+    def __init__(self, lanes: dict[str, LaneConfig] | None = None, cache=None, journal=None):
+        self.cache = cache      # Optional cache.ResultCache for fixed-seed results
+        self.journal = journal  # Optional journal.JobJournal recording every job
+        self.lanes = {name: Lane(name, config, runner=self._run_job) for name, config in (lanes or DEFAULT_LANES).items()}
+        self._leaders: dict[str, Job] = {}  # request_key -> in-flight job with an explicit seed
+        self._live: dict[str, Job] = {}     # Job.id -> unfinished job
+        self._cache_writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="fal-cache")
+        if journal is not None:
+            threading.Thread(target=self._take_over_loop, name="fal-take-over", daemon=True).start()
+        self._lock = threading.Lock()
+
+    def _on_update(self, job: Job):
+        """Listener for every job this scheduler owns: journals it and starts chained follow-ups."""
+        if self.journal is not None:
+            self.journal.record(job)
+        if job.status == "Completed" and job.chain and not job.child_id:
+            self._start_chain(job)
+
+    def _take_over_loop(self):
+        """Picks up jobs left behind by processes that stopped while this one keeps running."""
+        while True:
+            time.sleep(self.journal.lease)
+            self.resume()
+
+    def _start_chain(self, job: Job):
+        """Submits the job's follow-up with its output URL as the follow-up's `image_url`."""
+        template = job.chain
+        child = Job(template["model_id"], dict(template["api_args"], image_url=job.output["url"]),
+                    template["output_type"], job.prompt, job.api_key, session_id=job.session_id, lane=template.get("lane"))
+        try:
+            self.submit(child)
+        except Exception as e:
+            child.update(error=f"Could not start the follow-up job: {e}", finished_at=time.time(), status="Failed")
+        job.update(child_id=child.id)
+
+    def _run_job(self, job: Job):
+        run_job(job, lane=self.lane_for(job))
+        if self.cache is not None and job.status == "Completed" and "seed" in job.api_args:
+            # Written off the lane so a large media download does not hold one of its slots
+            self._cache_writer.submit(self._cache_result, job)
+
+    def _cache_result(self, job: Job):
+        try:
+            self.cache.put(request_key(job.model_id, job.api_args), job.model_id, job.result, job.output.get('url'))
+        except OSError:
+            pass  # A full or read-only disk only costs us the cache entry
+
+    def lane_for(self, job: Job) -> Lane:
+        name = job.lane or job.output_type
+        if name not in self.lanes:
+            raise ValueError(f"No scheduling lane named '{name}'.")
+        return self.lanes[name]
+
+    def submit(self, job: Job, max_in_flight: int | None = None) -> Job:
+        """Queues a job in its lane; raises QueueFullError if that lane is at capacity.
+
+        A job with an explicit seed is deterministic, so if an identical one is
+        already queued or running the new job attaches to it instead of paying
+        for a second inference.
+        """
+        job.listener = self._on_update
+        if not job.events:
+            job.events.append((job.status, job.submitted_at))
+        key = request_key(job.model_id, job.api_args) if "seed" in job.api_args else None
+        if key and self.cache is not None:
+            entry = self.cache.get(key)
+            output_data = extract_output(entry["result"], job.output_type) if entry else None
+            if output_data:
+                output_data = dict(output_data, local_path=entry["media_path"]) if entry["media_path"] else output_data
+                job.update(result=entry["result"], output=output_data, seed=entry["result"].get('seed', 'N/A'),
+                           cached=True, finished_at=time.time(), status="Completed")
+                return job
+        with self._lock:
+            self._leaders = {k: leader for k, leader in self._leaders.items() if leader.followers is not None}
+            self._live = {job_id: live for job_id, live in self._live.items() if not live.done}
+            self._live[job.id] = job
+            if key in self._leaders and self._leaders[key].attach(job):
+                return job
+            self.lane_for(job).submit(job, max_in_flight)
+            if key:
+                self._leaders[key] = job
+        if job.listener is not None:
+            job.listener(job)
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        """The live job object for an unfinished job, if this scheduler is running it."""
+        with self._lock:
+            return self._live.get(job_id)
+
+    def resume(self) -> list[Job]:
+        """Requeues the journal's unfinished jobs whose owner has stopped (see JobJournal.take_over).
+
+        Jobs that reached fal.ai are only polled again (they are already
+        running and billed); jobs that never left the local queue are submitted.
+        """
+        resumed = []
+        for job in self.journal.take_over() if self.journal is not None else []:
+            try:
+                if not job.api_key:
+                    raise RuntimeError("The API key for this job is no longer available.")
+                if job.status == "Attached":
+                    job.status = "Pending"
+                resumed.append(self.submit(job))
+            except Exception as e:
+                job.listener = self._on_update
+                job.update(error=f"Could not resume after restart: {e}", finished_at=time.time(), status="Failed")
+        return resumed
+
+    def depth(self, lane: str | None = None) -> int:
+        """Number of waiting jobs in one lane, or in all lanes."""
+        if lane is not None:
+            return self.lanes[lane].depth()
+        return sum(each.depth() for each in self.lanes.values())
+
+    def position(self, job: Job) -> int | None:
+        return self.lane_for(job).position(job)
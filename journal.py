@@ -0,0 +1,203 @@
+# journal.py
+# Durable SQLite journal of submitted jobs.
+# Every state change of a job is written here, so a browser reload or a
+# server restart can reattach to renders that fal.ai is still working on.
+# Several processes can share one journal: each unfinished job is leased to
+# the process running it, which renews the lease while it is alive, and only
+# jobs whose lease has lapsed are taken over by another process.
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from jobs import Job
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    model_id TEXT NOT NULL,
+    output_type TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    api_args TEXT NOT NULL,
+    meta TEXT NOT NULL,
+    api_key TEXT,
+    request_id TEXT,
+    status TEXT NOT NULL,
+    output TEXT,
+    seed TEXT,
+    error TEXT,
+    submitted_at REAL NOT NULL,
+    finished_at REAL,
+    owner TEXT,
+    heartbeat_at REAL
+);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    at REAL NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+CREATE INDEX IF NOT EXISTS jobs_session ON jobs (session_id, submitted_at);
+CREATE INDEX IF NOT EXISTS jobs_unfinished ON jobs (finished_at) WHERE finished_at IS NULL;
+"""
+
+ADDED_COLUMNS = {"owner": "TEXT", "heartbeat_at": "REAL"}  # Missing from journals created by older versions
+
+# Unfinished jobs another process may take over: their owner stopped renewing
+# the lease, or they belong to an earlier run of this owner (which has restarted)
+ORPHANED = """finished_at IS NULL AND status != 'Enqueued'
+    AND (owner IS NULL OR heartbeat_at < ? OR (owner = ? AND heartbeat_at < ?))"""
+
+class JobJournal:
+    """SQLite record of every job, keyed by Job.id.
+
+    The API key is kept only while a job is unfinished (it is needed to poll
+    fal.ai after a restart) and is wiped once the job completes or fails. The
+    database file is created readable by the owner only.
+
+    Rows written through this journal are owned by `owner`, which defaults to
+    this host and process. A background thread renews their `heartbeat_at`
+    every `lease / 3` seconds until they finish. Give each process a stable,
+    unique owner (FAL_WORKER_ID) to have a restart reclaim its jobs at once
+    instead of after their lease lapses.
+    """
+
+    def __init__(self, path: str, owner: str | None = None, lease: float = 60):
+        self.path = path
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease = lease
+        self.started_at = time.time()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if not os.path.exists(path):
+            os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for name, column_type in ADDED_COLUMNS.items():
+            if name not in columns:
+                try:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {column_type}")
+                except sqlite3.OperationalError:
+                    pass  # Another process added it first
+        self._lock = threading.Lock()
+        self._held: set[str] = set()  # Unfinished jobs this journal holds the lease on
+        threading.Thread(target=self._heartbeat_loop, name="journal-heartbeat", daemon=True).start()
+
+    def record(self, job: Job):
+        """Inserts or updates a job's row; safe to call from any thread."""
+        meta = {
+            "group": job.group, "label": job.label, "lane": job.lane, "hedge": job.hedge, "cached": job.cached,
+            "hedged": job.hedged, "retries": job.retries, "position": job.position, "note": job.note, "logs": job.logs,
+            "chain": job.chain, "child_id": job.child_id, "hedge_request_ids": job.hedge_request_ids
+        }
+        row = (
+            job.id, job.session_id, job.model_id, job.output_type, job.prompt,
+            json.dumps(job.api_args), json.dumps(meta), None if job.done else job.api_key,
+            job.request_id, job.status, json.dumps(job.output), json.dumps(job.seed), job.error,
+            job.submitted_at, job.finished_at, self.owner, time.time()
+        )
+        events = [(job.id, seq, status, at) for seq, (status, at) in enumerate(list(job.events))]
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+            self._conn.executemany("INSERT OR IGNORE INTO job_events VALUES (?, ?, ?, ?)", events)
+            if job.done:
+                self._held.discard(job.id)
+            else:
+                self._held.add(job.id)
+
+    def _query(self, where: str, params=()) -> list[Job]:
+        with self._lock:
+            rows = self._conn.execute(f"SELECT * FROM jobs WHERE {where} ORDER BY submitted_at", params).fetchall()
+        jobs = [self._to_job(row) for row in rows]
+        for job in jobs:
+            job.events = self.events(job.id)
+        return jobs
+
+    def get(self, job_id: str) -> Job | None:
+        jobs = self._query("id = ?", (job_id,))
+        return jobs[0] if jobs else None
+
+    def for_session(self, session_id: str) -> list[Job]:
+        return self._query("session_id = ?", (session_id,))
+
+    def take_over(self) -> list[Job]:
+        """Leases the unfinished jobs whose owner has gone away to this journal and returns them.
+
+        Jobs waiting for a worker are left to the workers. A job is only ever
+        taken over by one process, even when several look at the same time.
+        """
+        now = time.time()
+        params = (now - self.lease, self.owner, self.started_at)
+        taken = []
+        with self._lock:
+            rows = self._conn.execute(f"SELECT id FROM jobs WHERE {ORPHANED} ORDER BY submitted_at", params).fetchall()
+            for (job_id,) in rows:
+                cursor = self._conn.execute(f"UPDATE jobs SET owner = ?, heartbeat_at = ? WHERE id = ? AND {ORPHANED}",
+                                            (self.owner, now, job_id) + params)
+                if cursor.rowcount == 1:
+                    taken.append(job_id)
+                    self._held.add(job_id)
+        return [self.get(job_id) for job_id in taken]
+
+    def enqueue(self, job: Job):
+        """Hands a job to a worker process (see worker.py) instead of running it in this one."""
+        if not job.events:
+            job.events.append((job.status, job.submitted_at))
+        job.listener = self.record
+        job.update(status="Enqueued")
+
+    def claim(self, limit: int = 50) -> list[Job]:
+        """Atomically takes up to `limit` enqueued jobs, oldest first, for the calling worker."""
+        claimed = []
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM jobs WHERE status = 'Enqueued' ORDER BY submitted_at LIMIT ?",
+                                      (limit,)).fetchall()
+            for (job_id,) in rows:
+                cursor = self._conn.execute("UPDATE jobs SET status = 'Pending', owner = ?, heartbeat_at = ? "
+                                            "WHERE id = ? AND status = 'Enqueued'", (self.owner, time.time(), job_id))
+                if cursor.rowcount == 1:
+                    claimed.append(job_id)
+                    self._held.add(job_id)
+        jobs = [self.get(job_id) for job_id in claimed]
+        for job in jobs:
+            job.events.append(("Pending", time.time()))
+        return jobs
+
+    def _heartbeat_loop(self):
+        """Renews the lease on every job this journal holds."""
+        while True:
+            time.sleep(self.lease / 3)
+            with self._lock:
+                held = list(self._held)
+                for start in range(0, len(held), 500):
+                    chunk = held[start:start + 500]
+                    self._conn.execute(f"UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND id IN ({','.join('?' * len(chunk))})",
+                                       (time.time(), self.owner, *chunk))
+
+    def events(self, job_id: str) -> list[tuple[str, float]]:
+        """Timestamped status transitions of a job, oldest first."""
+        with self._lock:
+            return self._conn.execute("SELECT status, at FROM job_events WHERE job_id = ? ORDER BY seq", (job_id,)).fetchall()
+
+    @staticmethod
+    def _to_job(row) -> Job:
+        (job_id, session_id, model_id, output_type, prompt, api_args, meta, api_key,
+         request_id, status, output, seed, error, submitted_at, finished_at, *_) = row
+        meta = json.loads(meta)
+        return Job(
+            model_id, json.loads(api_args), output_type, prompt, api_key or "",
+            group=meta["group"], label=meta["label"], session_id=session_id, lane=meta["lane"],
+            hedge=meta["hedge"], cached=meta["cached"], hedged=meta.get("hedged", False),
+            hedge_request_ids=meta.get("hedge_request_ids", []), retries=meta.get("retries", 0),
+            position=meta.get("position"), note=meta.get("note"), logs=meta.get("logs", []),
+            chain=meta.get("chain"), child_id=meta.get("child_id"),
+            id=job_id, status=status, request_id=request_id,
+            output=json.loads(output), seed=json.loads(seed), error=error,
+            submitted_at=submitted_at, finished_at=finished_at
+        )
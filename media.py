@@ -0,0 +1,87 @@
+# media.py
+# Image processing for start images: shrinking them for upload and making
+# small previews.
+# Needs Pillow; without it (PIL_AVAILABLE is False) images are passed through
+# untouched.
+
+import io
+import math
+import os
+import time
+from dataclasses import dataclass
+
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+UPLOAD_FORMAT = os.environ.get("FAL_UPLOAD_FORMAT", "WEBP").upper()  # WEBP or JPEG
+UPLOAD_QUALITY = int(os.environ.get("FAL_UPLOAD_QUALITY", 90))
+THUMBNAIL_SIZE = 512  # Longest side of preview thumbnails, in pixels
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    content_type: str
+    original_bytes: int
+    seconds: float
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - len(self.data)
+
+def prepare_image(data: bytes, content_type: str, max_size: tuple[int, int]) -> PreparedImage:
+    """Shrinks an image until it just covers `max_size`, applies its EXIF rotation and re-encodes it.
+
+    The result carries no metadata. The original is kept if the image is
+    already small enough and re-encoding would not make it smaller.
+    """
+    started = time.perf_counter()
+    if not PIL_AVAILABLE:
+        return PreparedImage(data, content_type, len(data), 0.0)
+
+    with Image.open(io.BytesIO(data)) as image:
+        box = max_size
+        if image.getexif().get(0x0112) in (5, 6, 7, 8):  # Stored sideways; rotated by exif_transpose below
+            box = (max_size[1], max_size[0])
+        scale = min(1.0, max(box[0] / image.width, box[1] / image.height))
+        target = (math.ceil(image.width * scale), math.ceil(image.height * scale))
+        image.draft("RGB", target)  # Lets the JPEG decoder skip detail that would be thrown away
+        image.thumbnail(target, Image.LANCZOS)
+        image = ImageOps.exif_transpose(image)
+        output = io.BytesIO()
+        if UPLOAD_FORMAT == "JPEG":
+            image.convert("RGB").save(output, "JPEG", quality=UPLOAD_QUALITY, optimize=True)
+            prepared_type = "image/jpeg"
+        else:
+            has_alpha = "A" in image.getbands() or "transparency" in image.info
+            image.convert("RGBA" if has_alpha else "RGB").save(output, "WEBP", quality=UPLOAD_QUALITY, method=4)
+            prepared_type = "image/webp"
+
+    prepared = output.getvalue()
+    if scale == 1.0 and len(prepared) >= len(data):
+        return PreparedImage(data, content_type, len(data), time.perf_counter() - started)
+    return PreparedImage(prepared, prepared_type, len(data), time.perf_counter() - started)
+
+def is_image(data) -> bool:
+    """Whether `data` decodes as an image; always True without Pillow, which is needed to tell."""
+    if not PIL_AVAILABLE:
+        return True
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+    except Exception:  # Pillow raises a variety of errors for damaged or foreign data
+        return False
+    return True
+
+def make_thumbnail(data, max_side: int = THUMBNAIL_SIZE) -> bytes:
+    """A WebP preview of an image, at most `max_side` pixels on its longest side."""
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft("RGB", (max_side, max_side))
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        image = ImageOps.exif_transpose(image)
+        has_alpha = "A" in image.getbands() or "transparency" in image.info
+        output = io.BytesIO()
+        image.convert("RGBA" if has_alpha else "RGB").save(output, "WEBP", quality=80)
+    return output.getvalue()
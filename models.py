@@ -0,0 +1,120 @@
+# models.py
+# The fal.ai models offered by the app and the per-model argument logic,
+# shared by the Streamlit UI, the command-line runner and the HTTP API.
+
+from jobs import Job
+
+# Each model is scheduled in the lane named by its optional "lane" key,
+# falling back to its "output" type ("image" or "video").
+MODELS = {
+    "Text to Video": {
+        "id": "fal-ai/wan-25-preview/text-to-video",
+        "type": "text-to-video",
+        "output": "video"
+    },
+    "Image to Video": {
+        "id": "fal-ai/seed-1-image-to-video",
+        "type": "image-to-video",
+        "output": "video"
+    },
+    "Text to Image": {
+        "id": "fal-ai/stable-diffusion-xl-lightning",
+        "type": "text-to-image",
+        "output": "image"
+    },
+    "Image to Image": {
+        "id": "fal-ai/sdxl-img2img",
+        "type": "image-to-image",
+        "output": "image"
+    },
+}
+
+RESOLUTIONS = ["1024x1024", "1280x720 (16:9)", "720x1280 (9:16)", "1024x576"]
+
+def parse_resolution(resolution: str) -> tuple[int, int]:
+    """"1280x720 (16:9)" -> (1280, 720)"""
+    width, height = map(int, resolution.split(" ")[0].split("x"))
+    return width, height
+
+def input_size(model_type: str, resolution: str = RESOLUTIONS[0]) -> tuple[int, int] | None:
+    """The largest start image a model type makes use of, or None if it takes no image."""
+    if model_type == "image-to-video":
+        return parse_resolution(resolution)
+    if model_type == "image-to-image":
+        return (1024, 1024)
+    return None
+
+def build_api_args(model_type: str, prompt: str, image_url: str = None, *, negative_prompt: str = "",
+                   seed: int = -1, resolution: str = "1024x1024", duration: int = 5,
+                   strength: float = 0.75, audio_url: str = None) -> dict:
+    """Builds the request arguments for a model type from the generation settings."""
+    # Base arguments for all models
+    api_args = {"prompt": prompt}
+    if negative_prompt:
+        api_args["negative_prompt"] = negative_prompt
+    if seed != -1:
+        api_args["seed"] = seed
+
+    # Model-specific arguments
+    if model_type == "text-to-video":
+        api_args.update({
+            "aspect_ratio": "16:9" if "16:9" in resolution else "9:16" if "9:16" in resolution else "1:1",
+            "resolution": "1080p",
+            "duration": str(duration),
+            "enable_safety_checker": False
+        })
+        if audio_url:
+            api_args["audio_url"] = audio_url
+    elif model_type == "image-to-video":
+        width, height = parse_resolution(resolution)
+        api_args.update({
+            "image_url": image_url,
+            "width": width,
+            "height": height,
+            "enable_safety_checker": False
+        })
+    elif model_type == "image-to-image":
+        api_args.update({
+            "image_url": image_url,
+            "strength": strength,
+            "enable_safety_checker": False
+        })
+    elif model_type == "text-to-image":
+        api_args["enable_safety_checker"] = False
+    return api_args
+
+def resolve_mode(mode: str) -> dict:
+    """Finds a MODELS entry by its display name or its model type."""
+    for name, config in MODELS.items():
+        if mode in (name, config["type"]):
+            return config
+    raise ValueError(f"Unknown mode '{mode}'. Use one of: {', '.join(MODELS)}")
+
+def job_from_spec(spec: dict, api_key: str, image_url: str = None, session_id: str = "default") -> Job:
+    """Builds a Job from a plain dict of settings, such as a manifest row or an API request body."""
+    config = resolve_mode(spec["mode"])
+    if config["type"] in ["image-to-video", "image-to-image"] and not image_url:
+        raise ValueError("This mode requires a starting image.")
+    if not spec.get("prompt"):
+        raise ValueError("A prompt is required.")
+    api_args = build_api_args(
+        config["type"], spec["prompt"], image_url,
+        negative_prompt=spec.get("negative_prompt", ""),
+        seed=int(spec.get("seed", -1)),
+        resolution=spec.get("resolution", RESOLUTIONS[0]),
+        duration=int(spec.get("duration", 5)),
+        strength=float(spec.get("strength", 0.75)),
+        audio_url=spec.get("audio_url")
+    )
+    return Job(config["id"], api_args, config["output"], spec["prompt"], api_key,
+               session_id=session_id, lane=config.get("lane"))
+
+def chain_template(mode: str, prompt: str, **settings) -> dict:
+    """Describes a follow-up job whose `image_url` is filled in with the output of the job it follows."""
+    config = MODELS[mode]
+    return {
+        "model_id": config["id"],
+        "output_type": config["output"],
+        "lane": config.get("lane"),
+        "api_args": build_api_args(config["type"], prompt, None, **settings)
+    }
@@ -0,0 +1,146 @@
+# ratelimit.py
+# Client-side rate limiting and retries for fal.ai calls.
+# Every call made with an API key draws from that key's token bucket. The
+# bucket slows down when fal.ai answers 429 and speeds back up on success.
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import fal_client
+import httpx
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# ---------------------------
+# Token Bucket
+# ---------------------------
+class AdaptiveRateLimiter:
+    """Token bucket whose refill rate halves on throttling and creeps back up on success."""
+
+    def __init__(self, rate: float = 10.0, burst: int = 20, min_rate: float = 0.5, recovery: float = 0.1):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.recovery = recovery  # Requests/second regained per successful call
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.recovery)
+
+    def on_throttle(self, retry_after: float | None = None):
+        """Backs off after a 429, pausing the whole bucket if the server said for how long."""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+_limiters: dict[str, AdaptiveRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(api_key: str) -> AdaptiveRateLimiter:
+    """Returns the process-wide limiter for an API key."""
+    with _limiters_lock:
+        if api_key not in _limiters:
+            _limiters[api_key] = AdaptiveRateLimiter()
+        return _limiters[api_key]
+
+# ---------------------------
+# Retries
+# ---------------------------
+class RetryBudget:
+    """Number of retries a job may still spend across all of its calls."""
+
+    def __init__(self, retries: int = 5):
+        self.remaining = retries
+
+    def spend(self) -> bool:
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return True
+
+def is_transient(exc: Exception) -> bool:
+    """True for throttling, server-side and network errors that are worth retrying."""
+    if isinstance(exc, fal_client.FalClientHTTPError):
+        return exc.status_code in TRANSIENT_STATUS_CODES
+    return isinstance(exc, httpx.TransportError)
+
+def retry_after(exc: Exception) -> float | None:
+    """Seconds to wait according to the error's Retry-After header, if any."""
+    return parse_retry_after(getattr(exc, "response_headers", None) or {})
+
+def parse_retry_after(headers) -> float | None:
+    """Reads a Retry-After header given in seconds or as an HTTP date."""
+    value = next((v for k, v in headers.items() if k.lower() == "retry-after"), None)
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+def throttle_hook(api_key: str):
+    """An httpx response hook feeding every 429 into the key's limiter as it arrives.
+
+    fal_client retries 429s internally before raising, so without this the
+    limiter would only hear about throttling once those retries ran out.
+    """
+    def on_response(response: httpx.Response):
+        if response.status_code == 429:
+            response.extensions["throttle_reported"] = True
+            get_limiter(api_key).on_throttle(parse_retry_after(response.headers))
+    return on_response
+
+def call_with_retry(fn, *args, limiter: AdaptiveRateLimiter, budget: RetryBudget | None = None,
+                    base_delay: float = 1.0, max_delay: float = 30.0, on_retry=None, idempotent: bool = True, **kwargs):
+    """Calls `fn` through the limiter, retrying transient failures with jittered exponential backoff.
+
+    Calls that are not `idempotent` (e.g. a submit, which would be billed
+    twice) are only retried on 429, where the server has refused the request.
+    """
+    budget = budget or RetryBudget()
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            throttled = getattr(e, "status_code", None) == 429
+            if not (is_transient(e) if idempotent else throttled) or not budget.spend():
+                raise
+            wait = retry_after(e)
+            response = getattr(e, "response", None)
+            if throttled and not (response is not None and response.extensions.get("throttle_reported")):
+                limiter.on_throttle(wait)  # Not seen by a throttle_hook, e.g. an upload to the CDN
+            delay = max(wait or 0.0, random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+            attempt += 1
+            if on_retry:
+                on_retry(attempt, delay, e)
+            time.sleep(delay)
+        else:
+            limiter.on_success()
+            return result
@@ -0,0 +1,24 @@
+# records.py
+# Append-only JSONL record files: the CLI's results and workflow state files.
+# A run killed halfway through writing a line leaves a partial last line; it
+# is dropped when the file is read back, so reruns neither crash on it nor
+# glue their first record onto it.
+
+import json
+import os
+
+def read_records(path: str) -> list[dict]:
+    """Parses a JSONL file, repairing an unterminated last line so new records start on a line of their own."""
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb+") as f:
+        data = f.read()
+        body, _, tail = data.rpartition(b"\n")
+        records = [json.loads(line) for line in body.split(b"\n") if line.strip()]
+        if tail.strip():
+            try:
+                records.append(json.loads(tail))
+                f.write(b"\n")  # Complete line, only its newline was lost
+            except ValueError:
+                f.truncate(len(data) - len(tail))  # Cut short mid-record
+    return records
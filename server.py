@@ -0,0 +1,183 @@
+# server.py
+# Small JSON-over-HTTP API for the generation pipeline.
+#
+#   POST /jobs               submit a job; body like a cli.py manifest row plus
+#                            optional image_url / image_base64 + content_type,
+#                            api_key and client_id
+#   GET  /jobs/<id>          status, queue position and recent log lines
+#   GET  /jobs/<id>/result   the output once the job has completed
+#   GET  /models             the available modes
+#   GET  /stats              fal client pool statistics
+#
+# Run it inside the Streamlit process by setting FAL_HTTP_PORT (API and UI jobs
+# then share one scheduler), or standalone with `python server.py --port 8000`.
+# If FAL_HTTP_TOKEN is set, requests must send `Authorization: Bearer <token>`.
+# Without a token the server only binds to a loopback address, since anyone who
+# can reach it can spend the server's FAL_KEY.
+
+import argparse
+import base64
+import binascii
+import hmac
+import ipaddress
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from clients import CLIENTS
+from jobs import Job, QueueFullError
+from media import is_image
+from models import MODELS, job_from_spec, resolve_mode
+from services import create_journal, create_scheduler
+from uploads import upload_image_to_fal
+
+LOG_LINES = 20  # Log lines returned with a job's status
+MAX_BODY_BYTES = int(os.environ.get("FAL_HTTP_MAX_BODY_MB", 32)) * 1024**2  # Base64 start images included
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def job_status(job: Job) -> dict:
+    return {
+        "id": job.id, "status": job.status, "model_id": job.model_id, "request_id": job.request_id,
+        "position": job.position, "note": job.note, "logs": job.logs[-LOG_LINES:], "error": job.error,
+        "submitted_at": job.submitted_at, "finished_at": job.finished_at
+    }
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """Request handler; the owning ApiServer provides the scheduler and journal."""
+
+    def _send(self, code: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self) -> bool:
+        token = self.server.token
+        if not token:
+            return True
+        return hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {token}")
+
+    def _find(self, job_id: str) -> Job | None:
+        scheduler = self.server.scheduler
+        return (scheduler.get(job_id) if scheduler else None) or self.server.journal.get(job_id)
+
+    def do_GET(self):
+        if not self._authorized():
+            return self._send(401, {"error": "Unauthorized"})
+        parts = self.path.strip("/").split("/")
+        if parts == ["models"]:
+            return self._send(200, MODELS)
+        if parts == ["stats"]:
+            return self._send(200, {"clients": CLIENTS.stats()})
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self._find(parts[1])
+            if job is None:
+                return self._send(404, {"error": "Unknown job"})
+            if len(parts) == 2:
+                return self._send(200, job_status(job))
+            if parts[2] == "result":
+                if job.status != "Completed":
+                    return self._send(409, {"error": f"Job is {job.status}", **job_status(job)})
+                return self._send(200, {"id": job.id, "output": job.output, "seed": job.seed, "cached": job.cached})
+        self._send(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return self._send(401, {"error": "Unauthorized"})
+        if self.path.rstrip("/") != "/jobs":
+            return self._send(404, {"error": "Not found"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            return self._send(400, {"error": "Invalid Content-Length."})
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True  # The body is left unread
+            return self._send(413, {"error": f"Request bodies are limited to {MAX_BODY_BYTES // 1024**2} MB."})
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(body, dict):
+                return self._send(400, {"error": "The request body must be a JSON object."})
+            api_key = body.get("api_key") or self.server.default_api_key
+            if not api_key or ":" not in api_key:
+                return self._send(400, {"error": "A valid fal.ai API key is required."})
+
+            resolve_mode(body.get("mode", ""))  # Reject unknown modes before uploading anything
+            image_url = body.get("image_url")
+            if body.get("image_base64"):
+                try:
+                    image = base64.b64decode(body["image_base64"], validate=True)
+                except binascii.Error as e:
+                    raise ValueError(f"image_base64 is not valid base64: {e}") from None
+                if not is_image(image):
+                    raise ValueError("image_base64 does not contain a readable image.")
+                image_url = upload_image_to_fal(image, body.get("content_type", "image/png"), api_key)
+            job = job_from_spec(body, api_key, image_url, session_id=f"http:{body.get('client_id', 'default')}")
+        except (ValueError, KeyError, TypeError) as e:
+            return self._send(400, {"error": str(e)})
+        except Exception as e:
+            return self._send(502, {"error": f"Could not prepare the job: {e}"})
+
+        try:
+            if self.server.scheduler is None:
+                self.server.journal.enqueue(job)
+            else:
+                self.server.scheduler.submit(job)
+        except QueueFullError as e:
+            return self._send(503, {"error": str(e)})
+        self._send(202, job_status(job))
+
+    def log_message(self, format, *args):
+        pass  # Keep the Streamlit console quiet
+
+class ApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, journal, scheduler=None, token=None, default_api_key=None):
+        """`scheduler=None` hands jobs to the worker process through the journal instead."""
+        if not token and not is_loopback(address[0]):
+            raise ValueError(f"Refusing to serve on {address[0]} without FAL_HTTP_TOKEN; "
+                             "set a token or bind to 127.0.0.1.")
+        super().__init__(address, ApiHandler)
+        self.journal = journal
+        self.scheduler = scheduler
+        self.token = token
+        self.default_api_key = default_api_key
+
+def start_in_background(port: int, journal, scheduler=None, host: str = "127.0.0.1") -> ApiServer:
+    """Serves the API from a daemon thread, e.g. inside the Streamlit process."""
+    server = ApiServer((host, port), journal, scheduler,
+                       token=os.environ.get("FAL_HTTP_TOKEN"), default_api_key=os.environ.get("FAL_KEY"))
+    threading.Thread(target=server.serve_forever, name="fal-http-api", daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves the generation pipeline over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    if not os.environ.get("FAL_HTTP_TOKEN") and not is_loopback(args.host):
+        parser.error(f"Serving on {args.host} requires FAL_HTTP_TOKEN; anyone reaching the port could spend FAL_KEY.")
+
+    journal = create_journal()
+    scheduler = None if os.environ.get("FAL_USE_WORKER") == "1" else create_scheduler(journal)
+    server = ApiServer((args.host, args.port), journal, scheduler,
+                       token=os.environ.get("FAL_HTTP_TOKEN"), default_api_key=os.environ.get("FAL_KEY"))
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# services.py
+# Construction of the process-wide services (scheduler, result cache, job
+# journal, blob store) from environment variables, shared by the Streamlit app and the
+# standalone worker so both are configured the same way.
+
+import os
+
+from blobs import BlobStore
+from cache import ResultCache
+from jobs import DEFAULT_LANES, JobScheduler, LaneConfig
+from journal import JobJournal
+
+# Local state (result cache, job journal, etc.) lives here; it survives restarts.
+CACHE_DIR = os.environ.get("FAL_CACHE_DIR", ".cache")
+
+# Result files streamed to disk for the download buttons, kept for a day after their last download
+DOWNLOAD_DIR = os.path.join(CACHE_DIR, "downloads")
+DOWNLOAD_TTL = float(os.environ.get("FAL_DOWNLOAD_TTL_HOURS", 24)) * 3600
+
+def lanes_from_env(min_in_flight: int | None = None) -> dict[str, LaneConfig]:
+    """Lane limits, tunable with e.g. FAL_VIDEO_MAX_IN_FLIGHT=2 or FAL_IMAGE_MAX_QUEUED=500.
+
+    `min_in_flight` raises every lane's global and per-key caps to at least
+    that many jobs, for single-user runs such as cli.py --concurrency.
+    """
+    lanes = {}
+    for name, defaults in DEFAULT_LANES.items():
+        prefix = f"FAL_{name.upper()}_"
+        lanes[name] = LaneConfig(
+            max_in_flight=int(os.environ.get(prefix + "MAX_IN_FLIGHT", defaults.max_in_flight)),
+            max_in_flight_per_key=int(os.environ.get(prefix + "MAX_IN_FLIGHT_PER_KEY", defaults.max_in_flight_per_key)),
+            max_queued=int(os.environ.get(prefix + "MAX_QUEUED", defaults.max_queued))
+        )
+        if min_in_flight is not None:
+            lanes[name].max_in_flight = max(lanes[name].max_in_flight, min_in_flight)
+            lanes[name].max_in_flight_per_key = max(lanes[name].max_in_flight_per_key, min_in_flight)
+    return lanes
+
+def create_result_cache() -> ResultCache:
+    """Fixed-seed results are reused from disk instead of paying for the same inference twice."""
+    return ResultCache(
+        os.path.join(CACHE_DIR, "results"),
+        max_bytes=int(os.environ.get("FAL_RESULT_CACHE_MAX_MB", 2048)) * 1024**2,
+        ttl=float(os.environ.get("FAL_RESULT_CACHE_TTL_HOURS", 168)) * 3600,
+        store_media=os.environ.get("FAL_RESULT_CACHE_MEDIA") == "1"
+    )
+
+def create_blob_store() -> BlobStore:
+    """Uploaded files, kept out of session memory and shared by every session holding the same file."""
+    return BlobStore(
+        os.path.join(CACHE_DIR, "blobs"),
+        ttl=float(os.environ.get("FAL_BLOB_TTL_HOURS", 24)) * 3600,
+        max_bytes=int(os.environ.get("FAL_BLOB_MAX_MB", 5120)) * 1024**2
+    )
+
+def create_journal() -> JobJournal:
+    """The shared job journal; set FAL_WORKER_ID to a stable name per process so a restart resumes its jobs at once."""
+    return JobJournal(
+        os.path.join(CACHE_DIR, "jobs.sqlite3"),
+        owner=os.environ.get("FAL_WORKER_ID"),
+        lease=float(os.environ.get("FAL_JOB_LEASE_SECONDS", 60))
+    )
+
+def create_scheduler(journal: JobJournal) -> JobScheduler:
+    """Builds a scheduler and resumes the renders that were in flight when the process last stopped."""
+    scheduler = JobScheduler(lanes_from_env(), cache=create_result_cache(), journal=journal)
+    scheduler.resume()
+    return scheduler
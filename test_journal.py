@@ -0,0 +1,74 @@
+# test_journal.py
+# Job leases in the shared journal: who may take over an unfinished job, and
+# how a restarted process reattaches to renders that are still running.
+#
+#   python -m pytest -q test_journal.py
+
+import subprocess
+import sys
+import time
+
+import fal_client
+
+import jobs
+from jobs import Job, JobScheduler
+from journal import JobJournal
+
+def record_in_other_process(path: str, owner: str, **fields):
+    """Journals an in-flight job from a separate process that then exits, like a crashed worker."""
+    code = (
+        "import sys; sys.path.insert(0, sys.argv[1])\n"
+        "from jobs import Job; from journal import JobJournal\n"
+        f"job = Job('fal-ai/test', {{'prompt': 'p'}}, 'image', 'p', 'a:b', **{fields!r})\n"
+        f"JobJournal({path!r}, owner={owner!r}).record(job)\n"
+        "print(job.id)"
+    )
+    result = subprocess.run([sys.executable, "-c", code, sys.path[0] or "."], check=True, capture_output=True, text=True)
+    return result.stdout.strip()
+
+def test_live_jobs_are_left_to_their_owner(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    owner = JobJournal(path, owner="a", lease=60)
+    job = Job("fal-ai/test", {"prompt": "p"}, "image", "p", "a:b", status="Submitted", request_id="req-1")
+    owner.record(job)
+    assert JobJournal(path, owner="b", lease=60).take_over() == []
+
+def test_jobs_are_taken_over_once_the_lease_lapses(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    job_id = record_in_other_process(path, "gone", status="Pending")
+    other = JobJournal(path, owner="b", lease=1)
+    assert other.take_over() == []
+    time.sleep(1.2)
+    taken = other.take_over()
+    assert [job.id for job in taken] == [job_id]
+    assert JobJournal(path, owner="c", lease=1).take_over() == []  # Leased to "b" now
+
+def test_restart_with_the_same_owner_reattaches_without_resubmitting(tmp_path, monkeypatch):
+    path = str(tmp_path / "jobs.sqlite3")
+    job_id = record_in_other_process(path, "worker-1", status="In progress", request_id="req-9")
+
+    calls = []
+
+    class FakeClient:
+        def submit(self, *args, **kwargs):
+            calls.append("submit")
+            raise AssertionError("a job that reached fal.ai must not be submitted again")
+
+        def status(self, model_id, request_id, with_logs=False):
+            calls.append(("status", request_id))
+            return fal_client.Completed(logs=None, metrics={})
+
+        def result(self, model_id, request_id):
+            return {"images": [{"url": f"https://example.com/{request_id}.png"}], "seed": 1}
+
+    monkeypatch.setattr(jobs, "get_client", lambda api_key: FakeClient())
+    journal = JobJournal(path, owner="worker-1", lease=60)
+    resumed = JobScheduler(journal=journal).resume()
+    assert [job.id for job in resumed] == [job_id]
+
+    deadline = time.time() + 10
+    while journal.get(job_id).status != "Completed" and time.time() < deadline:
+        time.sleep(0.05)
+    assert resumed[0].status == "Completed"
+    assert resumed[0].output["url"] == "https://example.com/req-9.png"
+    assert "submit" not in calls
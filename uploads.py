@@ -0,0 +1,179 @@
+# uploads.py
+# Uploading start images to fal.ai storage.
+# Uploads are stored with an explicit expiry (FAL_UPLOAD_TTL_HOURS, default 24)
+# and remembered by content, so the same image is uploaded once per process no
+# matter how many sessions, batch rows or API requests use it. Start images
+# can also be shrunk to the size the model uses before they are sent (see
+# media.py).
+
+import mimetypes
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+
+from fal_client.client import StorageSettings
+
+from blobs import content_digest
+from clients import get_client
+from media import PreparedImage, prepare_image
+from ratelimit import RetryBudget, call_with_retry, get_limiter
+
+# Background uploads started before the user asks for a generation
+_upload_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="fal-upload")
+
+UPLOAD_TTL = float(os.environ.get("FAL_UPLOAD_TTL_HOURS", 24)) * 3600
+
+class UploadCache:
+    """Storage URLs of uploaded files by (content digest, content type).
+
+    An entry is handed out only while the file has at least `headroom` seconds
+    left in storage, so jobs that wait in a queue do not find it already gone.
+    """
+
+    def __init__(self, ttl: float = UPLOAD_TTL, headroom: float = 3600, max_entries: int = 1024):
+        self.reuse_for = max(ttl - headroom, ttl / 2)
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, str], tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest: str, content_type: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get((digest, content_type))
+            if entry is None:
+                return None
+            if time.time() - entry[1] > self.reuse_for:
+                del self._entries[(digest, content_type)]
+                return None
+            self._entries.move_to_end((digest, content_type))
+            return entry[0]
+
+    def put(self, digest: str, content_type: str, url: str):
+        with self._lock:
+            self._entries[(digest, content_type)] = (url, time.time())
+            self._entries.move_to_end((digest, content_type))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+UPLOADS = UploadCache()
+
+def upload_image_to_fal(file_data: bytes, content_type: str, api_key: str, digest: str | None = None):
+    """Uploads image data to fal.ai's storage and returns the URL, reusing an earlier upload of the same file."""
+    digest = digest or content_digest(file_data)
+    file_url = UPLOADS.get(digest, content_type)
+    if file_url is None:
+        if not isinstance(file_data, bytes):
+            file_data = bytes(file_data)  # e.g. a memory-mapped blob; the client needs real bytes
+        file_url = call_with_retry(get_client(api_key).upload, file_data, content_type=content_type,
+                                   lifecycle=StorageSettings(expires_in=int(UPLOAD_TTL)),
+                                   limiter=get_limiter(api_key), budget=RetryBudget(3))
+        UPLOADS.put(digest, content_type, file_url)
+    return file_url
+
+def upload_start_image(file_data: bytes, content_type: str, api_key: str, digest: str | None = None,
+                       max_size: tuple[int, int] | None = None) -> tuple[str, PreparedImage | None]:
+    """Uploads a start image, first shrinking it to `max_size` if given.
+
+    Returns the URL and the preprocessing stats (None if the image was sent
+    as-is or an earlier upload was reused).
+    """
+    digest = digest or content_digest(file_data)
+    if max_size is None:
+        return upload_image_to_fal(file_data, content_type, api_key, digest), None
+    prepared_key = f"{digest}@{max_size[0]}x{max_size[1]}"
+    file_url = UPLOADS.get(prepared_key, content_type)
+    if file_url is not None:
+        return file_url, None
+    prepared = prepare_image(file_data, content_type, max_size)
+    file_url = upload_image_to_fal(prepared.data, prepared.content_type, api_key)
+    UPLOADS.put(prepared_key, content_type, file_url)
+    return file_url, prepared
+
+def upload_many(files: list[tuple[bytes, str]], api_key: str, max_size: tuple[int, int] | None = None,
+                max_workers: int = 8, digests: list[str] | None = None) -> list[str]:
+    """Uploads several start images at once and returns their URLs in order.
+
+    Identical files are uploaded once and files uploaded earlier are reused
+    from the upload cache, so only new contents cost a round trip. Pass
+    `digests` when the files' content digests are already known (e.g. blob
+    store entries) to skip hashing them again.
+    """
+    digests = digests or [content_digest(data) for data, _ in files]
+    unique = {(digest, content_type): data for digest, (data, content_type) in zip(digests, files)}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(unique))), thread_name_prefix="fal-upload-batch") as pool:
+        futures = {key: pool.submit(upload_start_image, data, key[1], api_key, key[0], max_size)
+                   for key, data in unique.items()}
+        urls = {key: future.result()[0] for key, future in futures.items()}
+    return [urls[(digest, content_type)] for digest, (_, content_type) in zip(digests, files)]
+
+def resolve_image(image: str, api_key: str, uploaded: dict) -> str:
+    """Returns a URL for an image given as a path or URL, uploading local files once per path."""
+    if image.startswith(("http://", "https://", "data:")):
+        return image
+    if image not in uploaded:
+        content_type = mimetypes.guess_type(image)[0] or "image/png"
+        with open(image, "rb") as f:
+            uploaded[image] = upload_image_to_fal(f.read(), content_type, api_key)
+    return uploaded[image]
+
+class UploadPrefetcher:
+    """Uploads a session's start image in the background as soon as it is selected.
+
+    Generate then only waits for the URL instead of paying for the whole
+    upload. Selecting a different file (or key) cancels the pending upload if
+    it has not started yet and ignores its result otherwise.
+    """
+
+    def __init__(self):
+        self._key = None
+        self._future: Future | None = None
+        self._lock = threading.Lock()
+
+    def prefetch(self, file_data: bytes, content_type: str, api_key: str, digest: str | None = None,
+                 max_size: tuple[int, int] | None = None) -> Future:
+        """Starts preparing and uploading the file unless the same upload is already under way."""
+        digest = digest or content_digest(file_data)
+        key = (digest, content_type, api_key, max_size)
+        with self._lock:
+            if key != self._key:
+                if self._future is not None:
+                    self._future.cancel()
+                self._key = key
+                cached_url = UPLOADS.get(digest, content_type) if max_size is None else None
+                if cached_url is not None:
+                    self._future = Future()
+                    self._future.set_result((cached_url, None))
+                else:
+                    self._future = _upload_pool.submit(upload_start_image, file_data, content_type, api_key,
+                                                       digest, max_size)
+            return self._future
+
+    @property
+    def prepared(self) -> PreparedImage | None:
+        """Preprocessing stats of the current upload once it has finished."""
+        future = self._future
+        if future is None or not future.done() or future.cancelled() or future.exception():
+            return None
+        return future.result()[1]
+
+    def cancel(self):
+        """Forgets the pending upload, e.g. when the file is removed."""
+        with self._lock:
+            if self._future is not None:
+                self._future.cancel()
+            self._key = self._future = None
+
+    def result(self, file_data: bytes, content_type: str, api_key: str, digest: str | None = None,
+               max_size: tuple[int, int] | None = None) -> str:
+        """Waits for the file's URL, starting the upload now if it was not prefetched."""
+        future = self.prefetch(file_data, content_type, api_key, digest, max_size)
+        try:
+            return future.result()[0]
+        except CancelledError:
+            return upload_start_image(file_data, content_type, api_key, digest, max_size)[0]
+        except Exception:
+            with self._lock:
+                if self._future is future:
+                    self._key = self._future = None  # Retried on the next attempt
+            raise
@@ -0,0 +1,45 @@
+# worker.py
+# Standalone generation worker.
+# Run `python worker.py` next to the Streamlit app started with
+# FAL_USE_WORKER=1. The app then only writes jobs into the SQLite journal,
+# and this process claims them, runs the fal.ai calls on its own thread pools
+# and writes progress and results back for the UI to read.
+
+import argparse
+import os
+import time
+
+from jobs import QueueFullError
+from services import create_journal, create_scheduler
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs fal.ai generation jobs queued by the Streamlit app.")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="Seconds between checks for new jobs.")
+    parser.add_argument("--batch", type=int, default=50, help="Maximum jobs claimed per check.")
+    args = parser.parse_args()
+
+    journal = create_journal()
+    scheduler = create_scheduler(journal)
+    print(f"Worker {os.getpid()} watching {journal.path}")
+
+    backlog = []  # Claimed jobs waiting for room in their lane's queue
+    try:
+        while True:
+            if not backlog:
+                backlog = journal.claim(limit=args.batch)
+            while backlog:
+                job = backlog[0]
+                job.api_key = job.api_key or os.environ.get("FAL_KEY", "")
+                try:
+                    scheduler.submit(job)
+                except QueueFullError:
+                    break  # Retried once the lane drains
+                backlog.pop(0)
+            time.sleep(args.poll_interval)
+    except KeyboardInterrupt:
+        # Unfinished jobs stay in the journal; the next start with the same FAL_WORKER_ID resumes them at once,
+        # otherwise another process takes them over once their lease lapses
+        print("Worker stopped.")
+
+if __name__ == "__main__":
+    main()
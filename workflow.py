@@ -0,0 +1,257 @@
+# workflow.py
+# Multi-stage generation workflows.
+# A workflow file (YAML or JSON) names a set of nodes, each running one of the
+# MODELS modes. A node with `from` runs once per output of the node it names,
+# using that output's URL as its start image, so the nodes form a DAG:
+#
+#   nodes:
+#     stills:  {mode: Text to Image, prompt: "a lighthouse in a storm", count: 8, seed: 7}
+#     refine:  {mode: Image to Image, from: stills, take: 4, strength: 0.5}
+#     animate: {mode: Image to Video, from: refine, take: 2, resolution: "1280x720 (16:9)"}
+#
+#   python workflow.py flow.yaml --state flow.state.jsonl
+#
+# `count` runs every input with that many seeds (a fixed seed is incremented,
+# -1 picks random ones) and `take` feeds only the first N upstream outputs
+# forward. The other keys are the settings of a cli.py manifest row, and
+# `prompt` defaults to the upstream node's. Each output starts its downstream
+# jobs as soon as it completes and independent branches run side by side, all
+# within the scheduler's lane limits. Finished steps are appended to the state
+# file under a hash of their inputs, so rerunning a workflow resumes it.
+# YAML files need PyYAML; JSON files work without it.
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass
+
+from jobs import Job, JobScheduler, QueueFullError
+from models import job_from_spec, resolve_mode
+from records import read_records
+from services import create_result_cache, lanes_from_env
+from uploads import resolve_image
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+STRUCTURE_KEYS = ("from", "take", "count")  # Shape the graph rather than the requests
+
+# ---------------------------
+# Workflow Definitions
+# ---------------------------
+def load_workflow(path: str) -> dict[str, dict]:
+    """Reads a workflow file and returns its validated nodes in dependency order."""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise RuntimeError("Reading YAML workflows requires PyYAML (pip install pyyaml); JSON works without it.")
+            definition = yaml.safe_load(f)
+        else:
+            definition = json.load(f)
+    if not isinstance(definition, dict) or not isinstance(definition.get("nodes"), dict):
+        raise ValueError("A workflow needs a 'nodes' mapping of node names to settings.")
+    return ordered_nodes(definition["nodes"])
+
+def ordered_nodes(nodes: dict[str, dict]) -> dict[str, dict]:
+    """Validates the nodes and orders them so every node comes after the one it reads from."""
+    for name, node in nodes.items():
+        config = resolve_mode(node.get("mode", ""))
+        needs_image = config["type"] in ["image-to-video", "image-to-image"]
+        if node.get("from") is not None and node["from"] not in nodes:
+            raise ValueError(f"Node '{name}' reads from unknown node '{node['from']}'.")
+        if node.get("from") is not None and not needs_image:
+            raise ValueError(f"Node '{name}' uses {node['mode']}, which takes no input image.")
+        if node.get("from") is None and needs_image and not node.get("image"):
+            raise ValueError(f"Node '{name}' needs an 'image' or a 'from' node.")
+        if node.get("from") is not None and resolve_mode(nodes[node["from"]]["mode"])["output"] != "image":
+            raise ValueError(f"Node '{name}' can only read from a node that produces images.")
+
+    ordered = {}
+    while len(ordered) < len(nodes):
+        ready = [name for name, node in nodes.items()
+                 if name not in ordered and (node.get("from") is None or node["from"] in ordered)]
+        if not ready:
+            raise ValueError(f"The workflow has a cycle through: {', '.join(sorted(set(nodes) - set(ordered)))}")
+        for name in ready:
+            ordered[name] = nodes[name]
+    return ordered
+
+# ---------------------------
+# Execution
+# ---------------------------
+@dataclass
+class Step:
+    """One job of a node: the `index`-th output, built from one upstream output (or the node's own image)."""
+    node: str
+    index: int
+    upstream: "Step | None" = None
+    key: str | None = None   # Hash of the step's inputs, set once they are known
+    status: str = "Waiting"  # Waiting -> Running -> Completed / Failed
+    job: Job | None = None
+    url: str | None = None
+    seed: int | str | None = None
+    error: str | None = None
+
+def step_key(name: str, index: int, node: dict, image_url: str | None) -> str:
+    """Identifies a step by everything that determines its output, so reruns can reuse it."""
+    settings = {k: v for k, v in node.items() if k not in STRUCTURE_KEYS}
+    payload = {"node": name, "index": index, "settings": settings, "image_url": image_url}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def load_state(path: str) -> dict[str, dict]:
+    """Steps finished by earlier runs, keyed by their input hash (a last record cut short is dropped)."""
+    return {record["key"]: record for record in read_records(path)}
+
+class WorkflowRun:
+    """Runs a workflow's steps on a JobScheduler, streaming each output into the nodes that read from it."""
+
+    def __init__(self, nodes: dict[str, dict], scheduler: JobScheduler, api_key: str, state_path: str,
+                 session_id: str = "workflow", max_in_flight: int | None = None):
+        self.nodes = nodes
+        self.scheduler = scheduler
+        self.api_key = api_key
+        self.state_path = state_path
+        self.session_id = session_id
+        self.max_in_flight = max_in_flight
+        self.state = load_state(state_path)
+        self.uploaded = {}
+        self.steps: dict[str, list[Step]] = {}
+        for name, node in nodes.items():
+            count = int(node.get("count", 1))
+            if node.get("from") is None:
+                self.steps[name] = [Step(name, i) for i in range(count)]
+                continue
+            upstream = self.steps[node["from"]][:int(node.get("take", len(self.steps[node["from"]])))]
+            self.steps[name] = [Step(name, i * count + s, parent) for i, parent in enumerate(upstream) for s in range(count)]
+
+    @property
+    def done(self) -> bool:
+        return all(step.status in ("Completed", "Failed") for steps in self.steps.values() for step in steps)
+
+    def outputs(self) -> dict[str, list[str | None]]:
+        """Output URLs per node, in step order (None for failed steps)."""
+        return {name: [step.url for step in steps] for name, steps in self.steps.items()}
+
+    def _prompt(self, name: str) -> str | None:
+        """The node's prompt, or the prompt of the node it reads from."""
+        node = self.nodes[name]
+        if node.get("prompt") or node.get("from") is None:
+            return node.get("prompt")
+        return self._prompt(node["from"])
+
+    def _settings(self, step: Step) -> dict:
+        node = self.nodes[step.node]
+        settings = {k: v for k, v in node.items() if k not in STRUCTURE_KEYS + ("image",)}
+        settings["prompt"] = self._prompt(step.node)
+        seed = int(node.get("seed", -1))
+        count = int(node.get("count", 1))
+        # Distinct seeds per step; identical requests would otherwise be coalesced into one
+        settings["seed"] = seed + step.index % count if seed != -1 else random.randint(0, 2**31 - 1)
+        return settings
+
+    def _start(self, step: Step) -> bool:
+        """Resumes the step from the state file or submits its job; False if its lane is full."""
+        node = self.nodes[step.node]
+        if step.upstream is not None:
+            image_url = step.upstream.url
+        elif node.get("image"):
+            image_url = resolve_image(node["image"], self.api_key, self.uploaded)
+        else:
+            image_url = None
+        step.key = step.key or step_key(step.node, step.index, node, image_url)
+        if step.key in self.state:
+            record = self.state[step.key]
+            step.status, step.url, step.seed = "Completed", record["url"], record["seed"]
+            return True
+        job = step.job or job_from_spec({"mode": node["mode"], **self._settings(step)}, self.api_key, image_url,
+                                        session_id=self.session_id)
+        step.job = job
+        try:
+            self.scheduler.submit(job, max_in_flight=self.max_in_flight)
+        except QueueFullError:
+            return False
+        step.status = "Running"
+        return True
+
+    def _finish(self, step: Step):
+        job = step.job
+        if job.status != "Completed":
+            step.status, step.error = "Failed", job.error
+            return
+        step.status, step.url, step.seed = "Completed", job.output["url"], job.seed
+        record = {"key": step.key, "node": step.node, "index": step.index, "url": step.url, "seed": step.seed,
+                  "prompt": job.prompt, "request_id": job.request_id}
+        self.state[step.key] = record
+        with open(self.state_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def poll(self) -> list[Step]:
+        """Advances every step once and returns the steps that finished during this call."""
+        finished = []
+        lane_full = False
+        for steps in self.steps.values():  # Dependency order, so resumed outputs flow downstream in one pass
+            for step in steps:
+                if step.status == "Running" and step.job.done:
+                    self._finish(step)
+                    finished.append(step)
+                elif step.status == "Waiting" and step.upstream is not None and step.upstream.status == "Failed":
+                    step.status, step.error = "Failed", f"Upstream step {step.upstream.node}[{step.upstream.index}] failed."
+                    finished.append(step)
+                elif step.status == "Waiting" and not lane_full and (step.upstream is None or step.upstream.status == "Completed"):
+                    try:
+                        lane_full = not self._start(step)
+                    except Exception as e:
+                        step.status, step.error = "Failed", str(e)
+                    if step.status in ("Completed", "Failed"):
+                        finished.append(step)
+        return finished
+
+    def run(self, poll_interval: float = 0.5, on_finish=None) -> dict[str, list[str | None]]:
+        """Runs until every step has completed or failed, calling `on_finish(step)` as each one does."""
+        while True:
+            for step in self.poll():
+                if on_finish is not None:
+                    on_finish(step)
+            if self.done:
+                return self.outputs()
+            time.sleep(poll_interval)
+
+# ---------------------------
+# Entry Point
+# ---------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Runs a multi-stage fal.ai workflow.")
+    parser.add_argument("workflow", help="Path to a .yaml/.yml or .json workflow file.")
+    parser.add_argument("--state", help="JSONL file finished steps are recorded in (default: <workflow>.state.jsonl).")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum generations in flight at once.")
+    parser.add_argument("--api-key", default=os.environ.get("FAL_KEY"), help="fal.ai API key (default: $FAL_KEY).")
+    args = parser.parse_args()
+
+    if not args.api_key or ":" not in args.api_key:
+        parser.error("A valid fal.ai API key is required (--api-key or FAL_KEY).")
+    try:
+        nodes = load_workflow(args.workflow)
+    except (OSError, ValueError, RuntimeError) as e:
+        parser.error(str(e))
+
+    state_path = args.state or os.path.splitext(args.workflow)[0] + ".state.jsonl"
+    scheduler = JobScheduler(lanes_from_env(min_in_flight=args.concurrency), cache=create_result_cache())
+    workflow = WorkflowRun(nodes, scheduler, args.api_key, state_path, max_in_flight=args.concurrency)
+
+    def report(step: Step):
+        resumed = " (resumed)" if step.status == "Completed" and step.job is None else ""
+        print(f"[{'ok' if step.url else 'failed'}] {step.node}[{step.index}]{resumed}: {step.error or step.url}",
+              file=sys.stderr)
+
+    outputs = workflow.run(on_finish=report)
+    print(json.dumps(outputs, indent=2))
+    sys.exit(0 if all(url for urls in outputs.values() for url in urls) else 1)
+
+if __name__ == "__main__":
+    main()